@@ -0,0 +1,136 @@
+import io
+import os
+import contextlib
+import time
+import tempfile
+import numpy
+import sys
+
+sys.path.append('../Common')
+
+import Arb
+import FastLog
+import Instrument
+import Profile
+
+
+# Settings
+
+resource = 'SIM::NGU401::latency=0.0002::bandwidth=10e6'     # A real instrument resource benchmarks the actual link
+
+# Acquisition path of each capture script with the script's own timing: (name, consumer, output duration of the ARB
+# table in s or None if the output stays on, capture duration in s, timeout in s, tail in chunks, time spent by the
+# script between two blocks in s)
+configurations = \
+[
+    ('PowerCapture',   'record',  58.0,  58.0,  None, 3, 0),
+    ('RegulationVPM',  'capture', 1.63,  1.63,  2.13, 3, 0),
+    ('RegulationCPM',  'capture', 0.67,  0.67,  1.17, 3, 0),
+    ('RegulationLoad', 'capture', 0.33,  1.13,  1.63, 3, 0),
+    ('Modulation',     'capture', None,  3,     3.5,  3, 0),
+    ('PeltierPulse',   'blocks',  22.02, 22.02, None, 3, 0.002),   # Temperature UART read and buffer copies
+    ('PeltierPwm',     'blocks',  20,    20,    None, 3, 0.002),   # First 20 s of the 43 min schedule
+]
+
+
+# Code
+
+def run(fastLog, consumer, output, duration, timeout, tail, delay):
+    # The ARB table turns the output off at its end, so the capture ends the way it does in the script
+    if output is not None:
+        Arb.load(ngu401, Arb.table(5, 3, -3, output))
+        ngu401.write('ARB:STAT 1')
+    else:
+        ngu401.write('ARB:STAT 0')
+
+    fastLog.start()
+    ngu401.write('OUTP 1')
+
+    if consumer == 'record':
+        filename = os.path.join(tempfile.gettempdir(), 'benchmark')
+        fastLog.record(filename + '.npy', duration, timeout = timeout, tail = tail)
+
+        os.remove(filename + '.npy')
+        os.remove(filename + '.json')
+    elif consumer == 'capture':
+        fastLog.capture(duration, timeout = timeout, tail = tail)
+    else:
+        for v, i in fastLog.blocks(timeout = timeout, tail = tail):
+            time.sleep(delay)
+
+    ngu401.write('OUTP 0')
+    fastLog.stop()
+
+
+def report(name, fastLog):
+    timing = numpy.array(fastLog.timing)
+
+    if timing.shape[0] < 2:
+        print('{:16s} no data'.format(name))
+        return
+
+    wake, status, transfer, clear, samples = timing.T
+
+    elapsed = clear[-1] - status[0]
+    rate    = samples[1:].sum() / (clear[-1] - clear[0])
+    service = clear - wake                                  # Service time of each chunk from the wake up in s
+    latency = service * 1000
+    busy    = service.sum() / elapsed                       # Fraction of the time spent servicing chunks
+
+    p50, p90, p99 = numpy.percentile(latency, (50, 90, 99))
+
+    print('{:16s} {:9.0f} {:7.2f} {:7.2f} {:7.2f} {:7.2f} {:9.1f} {:9.1f} {:7.1f}% {:>8s} {:>8s} {:5s}'.format(
+        name, rate, p50, p90, p99, latency.max(), (transfer - status).sum() * 1000, (clear - transfer).sum() * 1000,
+        busy * 100, headroom(service, samples, fastLog.rate), fifo(), 'LOST' if fastLog.lost else 'ok'))
+
+
+def headroom(service, samples, rate):
+    # The reader drains whatever is in the FIFO, so it is busy most of the time at any link speed. The service time of
+    # a chunk is fitted as a + b * samples instead: 1 / b is the sample rate the link sustains with large chunks, the
+    # headroom is how many times the sample rate it is.
+    if numpy.ptp(samples) == 0:
+        return '-'
+
+    b, a = numpy.polyfit(samples, service, 1)
+
+    return '{:.2f}x'.format(1 / (b * rate)) if b > 0 else 'inf'
+
+
+def fifo():
+    # Peak FIFO occupancy as a fraction of the FIFO size, only known when running against the simulator
+    if not hasattr(ngu401, 'maxFifo'):
+        return '-'
+
+    peak, ngu401.maxFifo = ngu401.maxFifo, 0
+
+    return '{:.1f}%'.format(100 * peak / ngu401.fifoCapacity)
+
+
+ngu401 = Instrument.open(resource)
+ngu401.clear()
+
+Profile.reset(ngu401)
+
+setup = Profile.Profile('Benchmark', \
+[
+    'ARB:REP 1',                                    # 1 Repetition
+    'ARB:BEH:END OFF',                              # Disable output at end of ARB
+])
+
+setup.apply(ngu401)
+
+fastLog = FastLog.FastLog(ngu401, timing = True)
+fastLog.setup()
+
+ngu401.write('SOUR:VOLT 5')
+
+print('{:16s} {:>9s} {:>7s} {:>7s} {:>7s} {:>7s} {:>9s} {:>9s} {:>8s} {:>8s} {:>8s} {:5s}'.format(
+    'Configuration', 'S/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'data ms', 'clear ms', 'busy', 'headroom', 'FIFO max', 'data'))
+
+for name, consumer, output, duration, timeout, tail, delay in configurations:
+    fastLog.clear()
+
+    with contextlib.redirect_stdout(io.StringIO()):          # The progress messages are still published, but not shown
+        run(fastLog, consumer, output, duration, timeout, tail, delay)
+
+    report(name, fastLog)
@@ -0,0 +1,119 @@
+import threading
+import time
+import numpy
+
+import Profile
+
+
+# Arbitrary tables are (rows, 5) arrays of (value, upper limit, lower limit, duration, interpolation) points, the meaning
+# of the first three columns depends on the ARB priority mode.
+
+tableLimit = 4096           # Points accepted in a single table
+holdMargin = 0.005          # Time a segment is held past its end before the next one is started, covers the delay between
+                            # the start of FastLog and the start of the output
+restDuration = 0.001        # Duration of the rest point appended to the segments of a Sequence
+
+
+def table(first, second, third, duration, interpolation = 0):
+    # Table from columns, scalars are repeated on every point
+    columns = numpy.broadcast_arrays(first, second, third, duration, interpolation)
+
+    return numpy.column_stack([numpy.asarray(column, dtype = float) for column in columns])
+
+
+def format(table):
+    # ARB:DATA parameter list, formatted in a single pass
+    table = numpy.reshape(table, (-1, 5))
+
+    fields = numpy.empty(table.shape, dtype = object)
+    fields[:, : 4] = numpy.char.mod('%f', table[:, : 4])
+    fields[:, 4]   = numpy.char.mod('%d', table[:, 4].astype(int))
+
+    return ','.join(fields.ravel())
+
+
+def load(instrument, table):
+    # Defines and transfers the table
+    instrument.write('ARB:DATA ' + format(table))
+    instrument.write('ARB:TRAN 1')                  # Transfer the arbitrary table
+
+
+def split(table, limit = None):
+    # Consecutive segments of at most `limit` points, tableLimit by default
+    limit = tableLimit if limit is None else limit
+
+    return [table[start : start + limit] for start in range(0, table.shape[0], limit)]
+
+
+class Sequence:
+    # Plays a table longer than the instrument limit as consecutive segments, without stopping the output. The next
+    # segment is defined with ARB:DATA while the current one runs and is transferred once the current one has ended.
+    # Every segment but the last ends on a `rest` point, the (first, second, third) columns of a point where the output
+    # idles, which is held until the transfer, so the time the host takes to switch only lengthens a rest.
+    #
+    # update() is called by the FastLog reader after each chunk. The first segment is timed by the samples received since
+    # FastLog started, which can only be late, the next ones by the host time of their transfer. `times` holds the host
+    # time of each transfer after the first, FastLog.sample() converts them to the sample at which each segment started.
+    def __init__(self, instrument, table, rest, limit = None, lock = None):
+        limit    = tableLimit if limit is None else limit
+        restRow  = numpy.array([[rest[0], rest[1], rest[2], restDuration, 0]], dtype = float)
+        segments = split(table, limit - 1)
+
+        self.segments  = [numpy.concatenate((segment, restRow)) for segment in segments[: -1]] + segments[-1 :]
+        self.durations = [segment[:, 3].sum() for segment in segments]      # Without the rest point
+        self.times     = []
+
+        self._instrument = instrument
+        self._lock       = lock if lock is not None else threading.Lock()
+        self._index      = 0
+
+
+    def _define(self, index):
+        self._instrument.write('ARB:DATA ' + format(self.segments[index]))
+
+
+    def _transfer(self, index):
+        last = index == len(self.segments) - 1
+
+        self._instrument.write('ARB:BEH:END {:s}'.format('OFF' if last else 'HOLD'))
+        self._instrument.write('ARB:TRAN 1')
+        self._instrument.write('ARB:STAT 1')
+
+        Profile.state(self._instrument)['ARB:BEH:END'] = 'OFF' if last else 'HOLD'
+
+
+    def start(self):
+        # Loads the first segment and preloads the second one, the output is turned on by the caller
+        self._instrument.write('ARB:REP 1')
+
+        self._define(0)
+        self._transfer(0)
+
+        if len(self.segments) > 1:
+            self._define(1)
+
+        Profile.state(self._instrument)['ARB:REP'] = '1'
+
+
+    def update(self, samples, rate):
+        if self._index + 1 >= len(self.segments):
+            return
+
+        elapsed = samples / rate if self._index == 0 else time.perf_counter() - self.times[-1]
+
+        if elapsed < self.durations[self._index] + holdMargin:
+            return
+
+        self._index += 1
+
+        with self._lock:
+            self._transfer(self._index)
+
+            self.times.append(time.perf_counter())
+
+            if self._index + 1 < len(self.segments):
+                self._define(self._index + 1)
+
+
+def clear(instrument):
+    instrument.write('ARB:CLE')
@@ -0,0 +1,129 @@
+import json
+import os
+import struct
+import numpy
+
+import Clock
+
+
+# Captures are stored as a standard .npy file holding a (samples, 2) array of interleaved voltage/current pairs, so they
+# can be opened with numpy.load(filename, mmap_mode = 'r') without loading them. A .json file with the same name holds
+# the capture metadata.
+
+headerSize = 128            # Fixed .npy header size, so the header can be rewritten in place when the capture is closed
+chunkSize  = 1 << 18        # Samples staged in memory before each write
+
+
+def _header(samples, dtype):
+    header = "{{'descr': '{:s}', 'fortran_order': False, 'shape': ({:d}, 2), }}".format(numpy.dtype(dtype).str, samples)
+    header = header.ljust(headerSize - 11) + '\n'
+
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def _metadataFilename(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+
+class Writer:
+    # Append-only capture writer, memory use is bounded by the staging chunk and not by the capture duration
+    def __init__(self, filename, dtype = numpy.float32, chunkSize = chunkSize):
+        self.filename = filename
+        self.samples  = 0
+
+        self._dtype = numpy.dtype(dtype)
+        self._chunk = numpy.zeros((chunkSize, 2), dtype = self._dtype)
+        self._idx   = 0
+
+        self._file = open(filename, 'wb')
+        self._file.write(_header(0, self._dtype))
+
+
+    def append(self, v, i):
+        offset = 0
+
+        while offset < v.size:
+            size = min(v.size - offset, self._chunk.shape[0] - self._idx)
+
+            self._chunk[self._idx : self._idx + size, 0] = v[offset : offset + size]
+            self._chunk[self._idx : self._idx + size, 1] = i[offset : offset + size]
+
+            self._idx += size
+            offset    += size
+
+            if self._idx == self._chunk.shape[0]:
+                self.flush()
+
+
+    def flush(self):
+        self._file.write(self._chunk[: self._idx].tobytes())
+
+        self.samples += self._idx
+        self._idx     = 0
+
+
+    def close(self, **metadata):
+        self.flush()
+
+        self._file.seek(0)
+        self._file.write(_header(self.samples, self._dtype))
+        self._file.close()
+
+        annotate(self.filename, samples = self.samples, **metadata)
+
+
+def annotate(filename, **metadata):
+    # Writes the metadata file of a capture
+    with open(_metadataFilename(filename), 'w') as file:
+        json.dump(metadata, file, indent = 4)
+
+
+def save(filename, compress = False, **arrays):
+    # Saves the arrays without changing their type, compress selects the lossless compressed variant for archival
+    if compress:
+        numpy.savez_compressed(filename, **arrays)
+    else:
+        numpy.savez(filename, **arrays)
+
+
+def load(filename):
+    # Returns the voltage and current buffers of a streamed .npy capture as memory mapped views, .npz files written by
+    # numpy.savez with vBuffer/iBuffer are also accepted
+    if filename.endswith('.npz'):
+        file = numpy.load(filename)
+
+        return file['vBuffer'], file['iBuffer']
+
+    data = numpy.load(filename, mmap_mode = 'r')
+
+    return data[:, 0], data[:, 1]
+
+
+def metadata(filename):
+    try:
+        with open(_metadataFilename(filename)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def rate(filename, default = Clock.nominalRate):
+    # Sample rate stored with the capture, captures made before the sample clock was recorded return the default
+    if filename.endswith('.npz'):
+        file = numpy.load(filename)
+
+        if 'rate' in file:
+            return float(file['rate'])
+
+    return metadata(filename).get('rate', default)
+
+
+def gaps(filename):
+    # [index, length] pairs of the samples lost during the capture
+    if filename.endswith('.npz'):
+        file = numpy.load(filename)
+
+        if 'gaps' in file:
+            return numpy.reshape(file['gaps'], (-1, 2))
+
+    return numpy.reshape(numpy.array(metadata(filename).get('gaps', []), dtype = numpy.int64), (-1, 2))
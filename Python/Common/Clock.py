@@ -0,0 +1,139 @@
+import numpy
+
+
+# FastLog sample clock. The instrument clock runs slightly off its nominal 500 kS/s, the rate is fitted from the host
+# time at which each chunk was received and stored with the capture.
+#
+# Gaps are stored as [index, length] pairs: `length` samples were lost before the received sample `index`. The sample
+# clock is used to place the gaps reported by the instrument and estimate their length.
+
+nominalRate = 500_000 * 1.01348     # Rate measured on the review unit, used for captures without a fitted clock
+
+
+def _slope(index, timestamps, segment):
+    # Slope shared by all the segments, each segment has its own offset
+    x = index.copy()
+    y = timestamps.copy()
+
+    for s in numpy.unique(segment):
+        where = segment == s
+
+        x[where] -= x[where].mean()
+        y[where] -= y[where].mean()
+
+    if numpy.dot(x, x) == 0:
+        return None
+
+    return numpy.dot(x, y) / numpy.dot(x, x)
+
+
+def _offsets(index, timestamps, segment, slope):
+    return {s : numpy.median(timestamps[segment == s] - index[segment == s] * slope) for s in numpy.unique(segment)}
+
+
+def fit(index, timestamps, segment = None, default = nominalRate):
+    # Least squares fit of the host time against the sample index at the end of each chunk. Host timestamps are only
+    # ever late, so the fit is repeated on the chunks that arrived with less than the median delay. Chunks separated by
+    # a gap of unknown length belong to different segments.
+    index      = numpy.asarray(index, dtype = float)
+    timestamps = numpy.asarray(timestamps, dtype = float)
+    segment    = numpy.zeros(index.size, dtype = int) if segment is None else numpy.asarray(segment, dtype = int)
+
+    slope = _slope(index, timestamps, segment) if index.size >= 2 else None
+
+    if slope is None or slope <= 0:
+        return default
+
+    offsets  = _offsets(index, timestamps, segment, slope)
+    residual = timestamps - index * slope - numpy.array([offsets[s] for s in segment])
+    lower    = residual <= numpy.median(residual)
+
+    refined = _slope(index[lower], timestamps[lower], segment[lower])
+
+    if refined is not None and refined > 0:
+        slope = refined
+
+    return 1. / slope
+
+
+def index(times, index, timestamps, segment, rate):
+    # Sample index at host times. Host timestamps are only ever late, so the offset of each segment is taken from its
+    # earliest chunk, and a time belongs to the last segment started before it.
+    times      = numpy.asarray(times, dtype = float)
+    index      = numpy.asarray(index, dtype = float)
+    timestamps = numpy.asarray(timestamps, dtype = float)
+    segment    = numpy.asarray(segment, dtype = int)
+
+    if index.size == 0:
+        return numpy.zeros(times.shape, dtype = numpy.int64)
+
+    segments = numpy.unique(segment)
+    offsets  = numpy.array([numpy.min(timestamps[segment == s] - index[segment == s] / rate) for s in segments])
+    starts   = numpy.array([timestamps[segment == s].min() for s in segments])
+
+    where = numpy.maximum(numpy.searchsorted(starts, times, side = 'right') - 1, 0)
+
+    return numpy.round((times - offsets[where]) * rate).astype(numpy.int64)
+
+
+def locate(resumeTime, index, timestamps, segment, before, rate):
+    # Position and length of the gap between the segment `before` and the next one. Host timestamps are only ever late,
+    # and the chunks of the next segment that still drain the samples taken before the gap arrive later still, so the
+    # offset of each segment is taken from its earliest chunk. The instrument resumes when a read frees its FIFO, at
+    # `resumeTime`, the gap is placed at the sample the next segment gives for that time.
+    offsets = [numpy.min(timestamps[segment == s] - index[segment == s] / rate) for s in (before, before + 1)]
+
+    return int(round((resumeTime - offsets[1]) * rate)), max(int(round((offsets[1] - offsets[0]) * rate)), 0)
+
+
+def _table(gaps):
+    return numpy.reshape(numpy.asarray(gaps, dtype = numpy.int64), (-1, 2))
+
+
+def axis(size, rate = nominalRate, gaps = None):
+    # Time of each received sample, the samples after a gap are shifted by its length
+    if gaps is None:
+        return numpy.arange(size) / rate
+
+    gaps  = _table(gaps)
+    gaps  = gaps[gaps[:, 0] < size]
+    shift = numpy.zeros(size, dtype = numpy.int64)
+
+    numpy.add.at(shift, gaps[:, 0], gaps[:, 1])
+
+    return (numpy.arange(size) + numpy.cumsum(shift)) / rate
+
+
+def mask(size, gaps):
+    # Mask of the uniformly sampled time axis, False where samples were lost
+    gaps = _table(gaps)
+    gaps = gaps[gaps[:, 0] < size]
+
+    mask = numpy.ones(size + gaps[:, 1].sum(), dtype = bool)
+
+    for position, length in zip(gaps[:, 0] + numpy.cumsum(gaps[:, 1]) - gaps[:, 1], gaps[:, 1]):
+        mask[position : position + length] = False
+
+    return mask
+
+
+def expand(buffer, gaps):
+    # Copy of the buffer on the uniformly sampled time axis, lost samples are NaN. Without gaps the buffer itself is
+    # returned, so a memory mapped capture is not loaded.
+    if _table(gaps).shape[0] == 0:
+        return buffer
+
+    valid = mask(buffer.size, gaps)
+
+    expanded = numpy.full(valid.size, numpy.nan, dtype = buffer.dtype)
+    expanded[valid] = buffer
+
+    return expanded
+
+
+def crop(gaps, start, end):
+    # Gaps of the buffer slice [start, end)
+    gaps = _table(gaps)
+    gaps = gaps[numpy.logical_and(gaps[:, 0] > start, gaps[:, 0] < end)]
+
+    return gaps - [start, 0]
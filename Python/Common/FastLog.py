@@ -0,0 +1,435 @@
+import time
+import threading
+import numpy
+import pyvisa
+
+import Capture
+import Clock
+import Profile
+import Telemetry
+
+
+# Status register setup shared by every FastLog capture. FastLog data available (ISUM1 bit 4096) propagates to STB
+# bit 128, FastLog data skipped (ISUM1 bit 2048) propagates to STB bit 8.
+
+statusSetup = \
+[
+    'STAT:OPER:NTR 0',
+    'STAT:OPER:PTR 8192',
+    'STAT:OPER:ENABLE 8192',                        # Instrument operation summary
+    'STAT:OPER:INST:NTR 0',
+    'STAT:OPER:INST:PTR 2',
+    'STAT:OPER:INST:ENABLE 2',                      # Channel 1
+    'STAT:OPER:INST:ISUM1:NTR 0',
+    'STAT:OPER:INST:ISUM1:PTR 4096',
+    'STAT:OPER:INST:ISUM1:ENABLE 4096',             # Fastlog data available
+
+    'STAT:QUES:NTR 0',
+    'STAT:QUES:PTR 8192',
+    'STAT:QUES:ENABLE 8192',                        # Instrument questionable summary
+    'STAT:QUES:INST:NTR 0',
+    'STAT:QUES:INST:PTR 2',
+    'STAT:QUES:INST:ENABLE 2',                      # Channel 1
+    'STAT:QUES:INST:ISUM1:NTR 0',
+    'STAT:QUES:INST:ISUM1:PTR 2048',
+    'STAT:QUES:INST:ISUM1:ENABLE 2048',             # Fastlog data skipped
+
+    '*SRE 136',                                     # Service request on STB bit 128 or 8
+]
+
+# Event registers are read from the bottom of the tree to the top, so that a new event can not be lost between two reads
+
+operationClear    = 'STAT:OPER:INST:ISUM1:EVEN?;:STAT:OPER:INST:EVEN?;:STAT:OPER:EVEN?'
+questionableClear = 'STAT:QUES:INST:ISUM1:EVEN?;:STAT:QUES:INST:EVEN?;:STAT:QUES:EVEN?'
+
+dataAvailable = 128         # STB bit set by the operation summary
+dataSkipped   = 8           # STB bit set by the questionable summary
+
+maxRate = 510_000           # Upper bound of the sample rate, used to size buffers
+
+dtype      = numpy.float32              # FastLog samples are IEEE float32, they are kept as such from the instrument to the disk
+sampleType = numpy.dtype('<f4')         # Byte order of FLOG:DATA? blocks
+
+pollInterval = 0.005        # Consumer sleep when the ring buffer is empty
+
+waitTimeout = 100           # Service request wait in ms, bounds the time between two termination checks
+pollDelay   = 0             # Sleep between status byte polls when service requests are not available
+
+
+def decode(raw):
+    # Returns a (samples, 2) view of the voltage/current pairs of an IEEE 488.2 definite length block, the data is not
+    # copied. FastLog blocks are little endian float32.
+    start  = raw.index(b'#')
+    digits = int(raw[start + 1 : start + 2])
+    size   = int(raw[start + 2 : start + 2 + digits])
+
+    return numpy.frombuffer(raw, dtype = sampleType, count = size // sampleType.itemsize, offset = start + 2 + digits).reshape(-1, 2)
+
+
+class Ring:
+    # Single producer, single consumer ring buffer of interleaved voltage/current pairs. The producer only advances
+    # `_head` and the consumer only advances `_tail`, so the reader thread and the consumer never wait on each other.
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._data = numpy.zeros((capacity, 2), dtype = dtype)
+        self._head = 0
+        self._tail = 0
+
+
+    def write(self, block):
+        size = block.shape[0]
+
+        if size > self._capacity - (self._head - self._tail):
+            return False
+
+        start = self._head % self._capacity
+        first = min(size, self._capacity - start)
+
+        self._data[start : start + first] = block[: first]
+        self._data[: size - first] = block[first :]
+
+        self._head += size
+
+        return True
+
+
+    def read(self):
+        size = self._head - self._tail
+
+        if size == 0:
+            return None
+
+        start = self._tail % self._capacity
+        first = min(size, self._capacity - start)
+
+        if first == size:
+            block = self._data[start : start + size].copy()
+        else:
+            block = numpy.concatenate((self._data[start :], self._data[: size - first]))
+
+        self._tail += size
+
+        return block
+
+
+class FastLog:
+    # FastLog acquisition engine. The chunk loop runs in its own thread and is kept to two round trips per chunk: one
+    # FLOG:DATA? and one compound query that clears the operation event registers and reads back the output state.
+    # Between chunks the thread blocks on the instrument service request instead of polling the status byte.
+    def __init__(self, instrument, sampleRate = 'S500K', serviceRequest = True, timing = False):
+        self._instrument = instrument
+        self._profile    = Profile.Profile('FastLog', statusSetup + ['FLOG:TARG SCPI', 'FLOG:SRAT {:s}'.format(sampleRate)])
+
+        self._useServiceRequest = serviceRequest
+        self._serviceRequest    = False
+        self._timing            = timing             # Collect `timing`, it grows by a row per chunk so it is off by default
+
+        self.lock = threading.Lock()                 # Held around each transaction, so commands can be sent during a capture
+
+        self.lost        = False
+        self.samples     = 0
+        self.startTime   = 0
+        self.currentTime = 0
+        self.rate        = Clock.nominalRate
+
+        self.gaps        = []                        # [index, length] of the samples lost before sample `index`
+        self.timing      = []                        # [wake, status, transfer, clear, samples] host times of each chunk
+
+        self._clockIndex   = []
+        self._clockTime    = []
+        self._clockRequest = []                      # Host time at which each chunk was requested, to place the gaps
+        self._clockSegment = []
+        self._unknownGaps  = []                      # [gap, segment before it, resume time, dropped] of the skips reported
+
+        self._stopped   = True
+        self._finished  = True
+        self._exception = None
+
+
+    def setup(self):
+        self._profile.apply(self._instrument)
+
+        self.clear()
+
+
+    def clear(self):
+        self._instrument.query(operationClear + ';:' + questionableClear)
+
+
+    def start(self):
+        self._instrument.write('FLOG 1')
+        self._instrument.query('*OPC?')
+
+
+    def stop(self):
+        self._instrument.write('FLOG 0')
+        self._instrument.query('*OPC?')
+
+
+    def _enableServiceRequest(self):
+        # Backends without service request support fall back to polling the status byte
+        try:
+            self._instrument.discard_events(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+            self._instrument.enable_event(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+        except (pyvisa.errors.VisaIOError, NotImplementedError, AttributeError):
+            return False
+
+        return True
+
+
+    def _disableServiceRequest(self):
+        self._instrument.disable_event(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+        self._instrument.discard_events(pyvisa.constants.EventType.service_request, pyvisa.constants.EventMechanism.queue)
+
+
+    def _wait(self):
+        if self._serviceRequest:
+            self._instrument.wait_on_event(pyvisa.constants.EventType.service_request, waitTimeout, capture_timeout = True)
+        elif pollDelay > 0:
+            time.sleep(pollDelay)
+
+
+    def _read(self, ring, timeout, tail, callback):
+        # Reader thread: drains FLOG:DATA? into the ring buffer and handles termination, nothing else
+        remaining = None
+
+        stb = 0
+
+        segment       = 0                           # Chunks between two instrument skips share a segment of the sample clock
+        segmentChunks = 0
+        dropped       = 0                           # Samples read from the instrument that did not fit in the ring buffer
+
+        skipping = None                             # Skip whose backlog is being drained
+        backlog  = 0                                # Largest chunk read since the skip
+
+        try:
+            while not self._stopped:
+                if not stb & (dataAvailable | dataSkipped):  # Only wait when the last status byte had nothing pending
+                    skipping = None                 # Caught up
+                    self._wait()
+
+                wakeTime = time.perf_counter()
+
+                with self.lock:
+                    stb = self._instrument.read_stb()
+
+                currentTime = time.perf_counter()
+
+                if timeout is not None and self.startTime != 0 and currentTime - self.startTime > timeout:
+                    break
+
+                if stb & dataSkipped:
+                    with self.lock:
+                        self._instrument.query(questionableClear)
+
+                    self.lost = True
+
+                    # The FIFO still holds the samples taken before the skip and the skip keeps being reported until
+                    # the reader catches up, the skips reported until then are the same gap. It is placed and its
+                    # length fitted once the capture ends.
+
+                    if skipping is None and segmentChunks != 0:
+                        Telemetry.publish('Lost data! Samples skipped after sample {:d}'.format(self.samples))
+
+                        self.gaps.append([self.samples, 0])
+
+                        skipping = [len(self.gaps) - 1, segment, None, dropped]
+                        backlog  = 0
+
+                        self._unknownGaps.append(skipping)
+
+                        segment      += 1
+                        segmentChunks = 0
+
+                if stb & dataAvailable:
+                    if self.startTime == 0:
+                        self.startTime = currentTime
+
+                    with self.lock:
+                        requestTime = time.perf_counter()
+
+                        self._instrument.write('FLOG:DATA?')
+                        block = decode(self._instrument.read_raw())
+
+                        transferTime = time.perf_counter()
+
+                        output = int(self._instrument.query(operationClear + ';:OUTP?').split(';')[-1])
+
+                    self.currentTime = currentTime
+
+                    if skipping is not None:
+                        if skipping[2] is None:
+                            skipping[2] = requestTime           # The first read after the skip frees the FIFO
+                        elif block.shape[0] < backlog:
+                            skipping = None                     # Shorter than the backlog chunks, the FIFO is empty
+
+                        backlog = max(backlog, block.shape[0])
+
+                    if self._timing:
+                        self.timing.append([wakeTime, currentTime, transferTime, time.perf_counter(), block.shape[0]])
+
+                    if ring.write(block):
+                        self.samples += block.shape[0]
+                    else:
+                        Telemetry.publish('Lost data! Ring buffer overrun at sample {:d}'.format(self.samples))
+
+                        self.lost = True
+                        self.gaps.append([self.samples, block.shape[0]])
+
+                        dropped += block.shape[0]
+
+                    self._clockIndex.append(self.samples + dropped)     # Host time at which the last sample of the chunk had been
+                    self._clockTime.append(transferTime)                # received, never earlier than its acquisition
+                    self._clockRequest.append(requestTime)
+                    self._clockSegment.append(segment)
+
+                    segmentChunks += 1
+
+                    if callback is not None:
+                        callback(self.samples, self.rate)
+
+                    if remaining is not None:
+                        remaining -= 1
+
+                        if remaining <= 0:
+                            break
+                    elif output == 0:               # If output is off, get the last chunks of data before leaving
+                        remaining = tail
+        except Exception as exception:
+            self._exception = exception
+        finally:
+            self._finished = True
+
+
+    def blocks(self, timeout = None, tail = 3, capacity = 4, callback = None):
+        # Yields (v, i) blocks until the output has been off for `tail` chunks or `timeout` seconds have elapsed since
+        # the first chunk. The instrument is read by a background thread into a ring buffer of `capacity` seconds, so
+        # the time spent by the caller between blocks does not delay the reads. Skipped samples do not stop the capture,
+        # their position and length are stored in `gaps` once the iteration ends. `callback(samples, rate)` is called by
+        # the reader thread after each chunk, so it is not delayed by the caller either.
+        self.lost        = False
+        self.samples     = 0
+        self.startTime   = 0
+        self.currentTime = 0
+        self.rate        = Clock.nominalRate
+
+        self.gaps        = []
+        self.timing      = []
+
+        self._clockIndex   = []
+        self._clockTime    = []
+        self._clockRequest = []
+        self._clockSegment = []
+        self._unknownGaps  = []
+
+        self._stopped   = False
+        self._finished  = False
+        self._exception = None
+
+        ring = Ring(int(maxRate * capacity))
+
+        self._serviceRequest = self._useServiceRequest and self._enableServiceRequest()
+
+        reader = threading.Thread(target = self._read, args = (ring, timeout, tail, callback), daemon = True)
+        reader.start()
+
+        try:
+            while True:
+                finished = self._finished           # Read before the ring so that the last block is not missed
+                block = ring.read()
+
+                if block is not None:
+                    yield block[:, 0], block[:, 1]
+                elif finished:
+                    break
+                else:
+                    time.sleep(pollInterval)
+        finally:
+            self._stopped = True
+            reader.join()
+
+            if self._serviceRequest:
+                self._disableServiceRequest()
+
+            Telemetry.flush()
+
+            self._fitClock()
+
+        if self._exception is not None:
+            raise self._exception
+
+
+    def _fitClock(self):
+        # Sample clock and skipped gaps. The chunks read after a skip first drain the samples taken before it, they are
+        # moved back to the segment before the gap once it is placed, and the rate is fitted again without them. A gap
+        # that could not be placed, because the capture ended first, or that has no length is not stored.
+        index   = numpy.array(self._clockIndex, dtype = float)
+        request = numpy.array(self._clockRequest, dtype = float)
+        segment = numpy.array(self._clockSegment, dtype = int)
+
+        self.rate = Clock.fit(index, self._clockTime, segment)
+
+        for gap, before, resumeTime, dropped in self._unknownGaps:
+            after = segment == before + 1
+
+            if resumeTime is None or not after.any():
+                continue
+
+            position, length = Clock.locate(resumeTime, index, request, segment, before, self.rate)
+            position         = min(max(position, self.gaps[gap][0] + dropped), int(index[after].max()))
+
+            segment[numpy.logical_and(after, index <= position)] = before
+
+            self.gaps[gap] = [position - dropped, length]   # Received sample index, without the samples dropped before
+
+        if len(self._unknownGaps) != 0:
+            self.rate = Clock.fit(index, self._clockTime, segment)
+
+        self._clockSegment = segment.tolist()
+
+        self.gaps = sorted(gap for gap in self.gaps if gap[1] > 0)
+
+
+    def sample(self, times):
+        # Sample index at the given host times, from the clock fitted at the end of the last capture
+        return Clock.index(times, self._clockIndex, self._clockTime, self._clockSegment, self.rate)
+
+
+    def capture(self, duration, margin = 3, timeout = None, tail = 3, callback = None):
+        # Captures into a preallocated buffer sized for `duration + margin` seconds, the voltage and current buffers
+        # returned are views of its columns. `callback` is passed to blocks().
+        buffer = numpy.zeros((int(maxRate * (duration + margin)), 2), dtype = dtype)
+
+        idx = 0
+
+        blocks = self.blocks(timeout, tail, callback = callback)
+
+        for v, i in blocks:
+            buffer[idx : idx + v.size, 0] = v
+            buffer[idx : idx + i.size, 1] = i
+
+            idx += v.size
+
+            if idx + 2 * v.size > buffer.shape[0]:
+                break
+
+            Telemetry.publish('Remaining: {:.1f} s'.format(duration - (self.currentTime - self.startTime)), 'remaining')
+
+        blocks.close()                              # Stops the reader and fits the sample clock
+
+        return buffer[:idx, 0], buffer[:idx, 1]
+
+
+    def record(self, filename, duration, timeout = None, tail = 3):
+        # Streams the capture to disk, memory use does not depend on the duration
+        writer = Capture.Writer(filename)
+
+        try:
+            for v, i in self.blocks(timeout, tail):
+                writer.append(v, i)
+
+                Telemetry.publish('Remaining: {:.1f} s'.format(duration - (self.currentTime - self.startTime)), 'remaining')
+        finally:
+            writer.close(lost = self.lost, rate = self.rate, gaps = self.gaps)
+
+        return writer.samples
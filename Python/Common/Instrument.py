@@ -0,0 +1,18 @@
+import pyvisa
+
+import Trace
+
+
+# Opens an instrument by VISA resource string. Resources starting with SIM:: are served by the offline simulator, so the
+# acquisition scripts can be run and benchmarked without hardware, e.g. resource = 'SIM::NGU401::latency=0.0005'. With
+# trace the session is recorded by Trace under `name`, the resource string by default.
+
+def open(resource, timeout = 30_000, trace = False, name = None):
+    if resource.upper().startswith('SIM::'):
+        import Simulator
+
+        instrument = Simulator.open(resource, timeout)
+    else:
+        instrument = pyvisa.ResourceManager().open_resource(resource, timeout = timeout)
+
+    return Trace.wrap(instrument, name if name is not None else resource, trace)
@@ -0,0 +1,94 @@
+import numpy
+
+
+# Column sweep run by the K2450 itself. The script is loaded once, each call steps the source through a list of levels.
+# At each level it prints the index of the level, so the host knows the level is applied, and waits for a trigger (GET)
+# from the host, which decides when the output has settled. It then reads the input until the last `window` readings
+# agree within `rtol` of the last one plus `atol`, or `count` readings were taken, and ends the column by itself when the
+# last reading is over `limit`. It prints 0 when the column ends. The source value, reading and settled flag of every
+# level are returned by a single query, a column still takes a trigger and a ready read per level.
+
+script = \
+[
+    'loadscript ColumnSweep',
+    'function column(levels, timeout, window, count, rtol, atol, limit)',
+    '    defbuffer1.clear()',
+    '    columnResult = ""',
+    '    local results = {}',
+    '    for index = 1, table.getn(levels) do',
+    '        smu.source.level = levels[index]',
+    '        trigger.clear()',
+    '        print(index)',
+    '        if not trigger.wait(timeout) then break end',
+    '        local settled = 0',
+    '        for reading = 1, count do',
+    '            smu.measure.read(defbuffer1)',
+    '            local last = defbuffer1.readings[defbuffer1.n]',
+    '            local low, high = last, last',
+    '            for previous = math.max(defbuffer1.n - window + 1, 1), defbuffer1.n do',
+    '                low  = math.min(low, defbuffer1.readings[previous])',
+    '                high = math.max(high, defbuffer1.readings[previous])',
+    '            end',
+    '            if reading >= window and high - low <= rtol * math.abs(last) + atol then',
+    '                settled = 1',
+    '                break',
+    '            end',
+    '        end',
+    '        local n = defbuffer1.n',
+    '        table.insert(results, string.format("%.9g,%.9g,%d", defbuffer1.sourcevalues[n], defbuffer1.readings[n], settled))',
+    '        columnResult = table.concat(results, ",")',
+    '        if math.abs(defbuffer1.readings[n]) > limit then break end',
+    '    end',
+    '    print(0)',
+    'end',
+    'endscript',
+    'ColumnSweep()',
+]
+
+
+class Column:
+    def __init__(self, instrument, timeout = 10, window = 3, count = 10, rtol = 1e-3, atol = 0., limit = 1.0):
+        self._instrument = instrument
+        self._timeout    = timeout          # Time the script waits for the next trigger before giving up
+        self._settling   = (window, count, rtol, atol)
+        self._limit      = limit            # Input current that ends the column
+
+        for line in script:
+            self._instrument.write(line)
+
+
+    def start(self, levels):
+        # Sets the first level and returns once it is applied, the script then runs until every level is measured, a
+        # reading is over the limit or it is stopped
+        self._instrument.write('column({{{:s}}}, {:g}, {:d}, {:d}, {:g}, {:g}, {:g})'.format(
+                               ','.join('{:f}'.format(level) for level in levels), self._timeout, *self._settling, self._limit))
+
+        return self._ready()
+
+
+    def trigger(self):
+        # Measures the current level and moves to the next one. Returns once the next level is applied, False if the
+        # column ended instead.
+        self._instrument.assert_trigger()
+
+        return self._ready()
+
+
+    def _ready(self):
+        # Index of the level the script waits at, 0 once it ended
+        return int(float(self._instrument.read())) != 0
+
+
+    def stop(self):
+        # Device clear aborts the script, the levels already measured are kept in columnResult
+        self._instrument.clear()
+
+
+    def fetch(self):
+        # (source, reading, settled) of the levels measured, waits for the script to end
+        response = self._instrument.query('print(columnResult)')
+
+        if response.strip() == '':
+            return numpy.zeros((0, 3))
+
+        return numpy.array([float(x) for x in response.split(',')]).reshape(-1, 3)
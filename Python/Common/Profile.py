@@ -0,0 +1,85 @@
+# Named instrument setups. A profile is sent as a few semicolon joined writes and verified with a single readback query,
+# settings already known to be in effect on the instrument are not sent again.
+
+batchSize = 512             # Maximum length of a batched write
+
+known = {}                  # Settings known to be in effect, by instrument
+
+
+def state(instrument):
+    return known.setdefault(instrument, {})
+
+
+def reset(instrument):
+    # *RST returns every setting to its default, nothing is known to be in effect afterwards
+    instrument.write('*RST')
+    instrument.query('*OPC?')
+
+    known[instrument] = {}
+
+
+def _split(command):
+    header, _, value = command.partition(' ')
+
+    return header.upper(), value.strip()
+
+
+def _join(commands):
+    # Every header is made absolute, so that it is not resolved relative to the previous command of the batch
+    return ';'.join(command if command.startswith('*') else ':' + command.lstrip(':') for command in commands)
+
+
+def _batches(commands):
+    batch = []
+    size  = 0
+
+    for command in commands:
+        if len(batch) != 0 and size + len(command) + 2 > batchSize:
+            yield batch
+
+            batch = []
+            size  = 0
+
+        batch.append(command)
+        size += len(command) + 2
+
+    if len(batch) != 0:
+        yield batch
+
+
+def _equal(value, response):
+    try:
+        return float(value) == float(response)
+    except ValueError:
+        return value.upper() == response.strip().strip('"').upper()
+
+
+class Profile:
+    def __init__(self, name, commands):
+        self.name     = name
+        self.commands = list(commands)
+
+
+    def apply(self, instrument, verify = True):
+        current = state(instrument)
+
+        pending = [command for command in self.commands if current.get(_split(command)[0]) != _split(command)[1]]
+
+        if len(pending) == 0:
+            return
+
+        for batch in _batches(pending):
+            instrument.write(_join(batch))
+
+        if verify:
+            headers  = [_split(command)[0] for command in pending]
+            response = instrument.query(_join(header + '?' for header in headers)).strip().split(';')
+
+            mismatch = [command for command, value in zip(pending, response) if not _equal(_split(command)[1], value)]
+
+            if len(response) != len(pending) or len(mismatch) != 0:
+                raise RuntimeError('{:s} profile not in effect: {:s}'.format(self.name, ', '.join(mismatch)))
+
+        for command in pending:
+            header, value = _split(command)
+            current[header] = value
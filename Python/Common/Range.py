@@ -0,0 +1,102 @@
+import numpy
+
+
+# Measurement range locking. Instead of autoranging on every reading, the range of each quantity is pinned to the
+# smallest one holding the value predicted from the commanded setpoint or the previous reading, with some headroom. A
+# reading at or past full scale of the pinned range is repeated in autorange and the next range is taken from it.
+#
+#   ranges = [Range.ngu401(ngu401, 'VOLT'), Range.ngu401(ngu401, 'CURR')]
+#   v, i   = Range.read(read, ranges, (setpoint, None))
+
+ngu401Voltage = (6, 20)                                 # NGU401 readback ranges, in V and A, the current ranges are
+ngu401Current = (10e-6, 1e-3, 100e-3, 10)               # also the ones SOUR:CURR:RANG selects from
+k2450Current  = (100e-6, 1e-3, 10e-3, 100e-3, 1)        # K2450 measure ranges from smu.measure.autorangelow = 1E-4 up
+
+headroom = 1.2              # Predicted value times headroom must fit in the range, switching down needs headroom squared
+overflow = 9.9e37           # Value returned by the instruments when a reading is out of range
+
+
+class Ranger:
+    def __init__(self, ranges, pin, auto):
+        self.ranges = sorted(ranges)
+        self.range  = None          # Pinned range, None in autorange
+        self.last   = None          # Previous reading
+
+        self._pin  = pin
+        self._auto = auto
+
+
+    def select(self, value):
+        # Smallest range holding the value with headroom, the pinned one is kept unless the value is well below it
+        value  = abs(value) * headroom
+        target = next((r for r in self.ranges if r >= value), self.ranges[-1])
+
+        if self.range is not None and target < self.range and target < value * headroom:
+            target = self.range
+
+        return target
+
+
+    def pin(self, prediction = None):
+        # Without a prediction the previous reading is used, without either the range is left as it is
+        value = prediction if prediction is not None else self.last
+
+        if value is None:
+            return
+
+        target = self.select(value)
+
+        if target != self.range:
+            self._pin(target)
+            self.range = target
+
+
+    def auto(self):
+        if self.range is not None:
+            self._auto()
+            self.range = None
+
+
+    def overflowed(self, reading):
+        return not numpy.isfinite(reading) or abs(reading) >= overflow or (self.range is not None and abs(reading) >= self.range)
+
+
+def ngu401(instrument, quantity):
+    # quantity is 'VOLT' or 'CURR'
+    ranges = ngu401Voltage if quantity == 'VOLT' else ngu401Current
+
+    return Ranger(ranges, lambda value: instrument.write('SENS:{:s}:RANG {:g}'.format(quantity, value)),
+                  lambda: instrument.write('SENS:{:s}:RANG:AUTO 1'.format(quantity)))
+
+
+def k2450(instrument):
+    # Measured current of the K2450 sourcing voltage
+    return Ranger(k2450Current, lambda value: instrument.write('smu.measure.range = {:g}'.format(value)),
+                  lambda: instrument.write('smu.measure.autorange = smu.ON'))
+
+
+def read(read, rangers, predictions = None):
+    # Reads with every quantity pinned to its predicted range, a reading that overflowed is repeated in autorange.
+    # predictions holds a value or None (previous reading) for each quantity of the reading, rangers may hold None for
+    # the quantities that are not range locked.
+    predictions = predictions if predictions is not None else [None] * len(rangers)
+
+    for ranger, prediction in zip(rangers, predictions):
+        if ranger is not None:
+            ranger.pin(prediction)
+
+    values = read()
+    over   = [ranger is not None and ranger.overflowed(value) for ranger, value in zip(rangers, values)]
+
+    if any(over):
+        for ranger, overflowed in zip(rangers, over):
+            if overflowed:
+                ranger.auto()
+
+        values = read()
+
+    for ranger, value in zip(rangers, values):
+        if ranger is not None:
+            ranger.last = value
+
+    return values
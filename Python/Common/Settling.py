@@ -0,0 +1,29 @@
+import time
+import numpy
+
+
+# Settling detection. The readings are repeated until the last `window` of them agree within `rtol` of the last value
+# plus `atol`, for every quantity, or until `timeout` seconds have elapsed.
+
+def settle(read, rtol = 1e-3, atol = 0., window = 3, timeout = 2., interval = 0.):
+    # Returns the last reading, the time it took and whether the criterion was met
+    start    = time.perf_counter()
+    readings = []
+
+    while True:
+        readings.append(numpy.asarray(read(), dtype = float))
+
+        elapsed = time.perf_counter() - start
+
+        if len(readings) >= window:
+            last   = numpy.array(readings[-window:])
+            spread = last.max(axis = 0) - last.min(axis = 0)
+
+            if numpy.all(spread <= rtol * numpy.abs(last[-1]) + atol):
+                return readings[-1], elapsed, True
+
+        if elapsed >= timeout:
+            return readings[-1], elapsed, False
+
+        if interval > 0:
+            time.sleep(interval)
@@ -0,0 +1,422 @@
+import time
+import collections
+import numpy
+
+
+# Offline stand-in for the NGU401, it implements the subset of the resource interface and of the SCPI commands used by
+# the measurement scripts. FastLog samples are produced in real time into a FIFO of limited size, the samples that do
+# not fit are skipped and reported through the questionable status register like on the instrument.
+#
+# Resource string: SIM::NGU401[::option=value]..., for example 'SIM::NGU401::latency=0.0005::bandwidth=10e6'
+
+defaults = \
+{
+    'latency'   : 0.0002,               # Round trip time of a transaction in s
+    'bandwidth' : 10e6,                 # Link bandwidth in bytes/s
+    'clock'     : 1.01348,              # Sample clock error, the review unit runs 1.348% fast
+    'chunk'     : 1000,                 # Samples needed to signal data available
+    'block'     : 10_000,               # Maximum samples per FLOG:DATA? block
+    'fifo'      : 100_000,              # FastLog FIFO size in samples
+    'load'      : 8.0,                  # Resistive load in ohm
+    'noise'     : 0.001,                # Measurement noise standard deviation
+}
+
+rates = {'S500K' : 500_000, 'S250K' : 250_000, 'S50K' : 50_000, 'S10K' : 10_000, 'S1K' : 1_000, 'S100' : 100, 'S10' : 10}
+
+
+class WaitResponse:
+    def __init__(self, timedOut):
+        self.timed_out = timedOut
+
+
+class NGU401:
+    def __init__(self, resourceName = 'SIM::NGU401', **options):
+        self.resource_name = resourceName
+        self.timeout       = 30_000
+
+        self._options = dict(defaults)
+        self._options.update(options)
+
+        self.fifoCapacity = self._options['fifo']       # FastLog FIFO size in samples, known to the benchmark
+
+        self._random  = numpy.random.default_rng(0)
+        self._pending = b''
+
+        self._reset()
+
+
+    # Resource interface
+
+    def clear(self):
+        self._pending = b''
+
+
+    def close(self):
+        pass
+
+
+    def write(self, command):
+        self._link(0, len(command))
+
+        response = self._execute(command)
+
+        if response is not None:
+            self._pending = response
+
+
+    def query(self, command):
+        response = self._execute(command)
+
+        if isinstance(response, bytes):
+            response = response.decode('latin1')
+
+        self._link(self._options['latency'], len(command) + len(response))
+
+        return response + '\n'
+
+
+    def read_raw(self, size = None):
+        response, self._pending = self._pending, b''
+
+        self._link(self._options['latency'], len(response))
+
+        return response
+
+
+    def query_binary_values(self, command, datatype = 'f', is_big_endian = False, container = list, data_points = 0):
+        self.write(command)
+
+        raw    = self.read_raw()
+        digits = int(raw[1 : 2])
+        data   = numpy.frombuffer(raw, dtype = '<f4', offset = 2 + digits, count = int(raw[2 : 2 + digits]) // 4)
+
+        return container(data.tolist())
+
+
+    def read_stb(self):
+        self._link(self._options['latency'], 1)
+        self._update()
+
+        return (128 if self._operationEvent else 0) | (8 if self._questionableEvent else 0)
+
+
+    def discard_events(self, eventType, mechanism):
+        pass
+
+
+    def enable_event(self, eventType, mechanism, context = None):
+        pass
+
+
+    def disable_event(self, eventType, mechanism):
+        pass
+
+
+    def wait_on_event(self, eventType, timeout, capture_timeout = False):
+        # Service request: returns as soon as a FastLog chunk is available or samples were skipped
+        end = time.perf_counter() + timeout / 1000.
+
+        while True:
+            self._update()
+
+            if self._operationEvent or self._questionableEvent:
+                return WaitResponse(False)
+
+            now = time.perf_counter()
+
+            if now >= end:
+                return WaitResponse(True)
+
+            time.sleep(min(end - now, max(self._chunkDue() - now, 0.0001)))
+
+
+    # Instrument model
+
+    def _reset(self):
+        self._settings = {}
+
+        self._arb      = None               # (rows, 5) table transferred with ARB:TRAN
+        self._arbData  = None               # Table defined with ARB:DATA
+        self._arbStart = None
+
+        self._outputOn  = None              # Host time the output was turned on
+        self._outputOff = None              # Host time the output was (or will be) turned off
+
+        self._flogStart = None
+        self._produced  = 0                 # Samples produced since FastLog was started
+        self._fifo      = collections.deque()
+        self._fifoSize  = 0
+        self.skipped    = 0
+        self.maxFifo    = 0
+
+        self._operationEvent    = False
+        self._questionableEvent = False
+
+
+    def _link(self, latency, size):
+        time.sleep(latency + size / self._options['bandwidth'])
+
+
+    def _rate(self):
+        return rates.get(self._settings.get('FLOG:SRAT', 'S500K').upper(), 500_000) * self._options['clock']
+
+
+    def _chunkDue(self):
+        if self._flogStart is None:
+            return time.perf_counter() + 0.001
+
+        missing = max(self._options['chunk'] - self._fifoSize, 1)
+
+        return self._flogStart + (self._produced + missing) / self._rate()
+
+
+    def _update(self):
+        now = time.perf_counter()
+
+        if self._outputOff is not None and now >= self._outputOff and self._outputOn is not None:
+            self._outputOn = None
+
+        if self._flogStart is None:
+            return
+
+        produced = int((now - self._flogStart) * self._rate())
+        new      = produced - self._produced
+
+        if new > 0:
+            accepted = min(new, self._options['fifo'] - self._fifoSize)
+
+            if accepted > 0:
+                if len(self._fifo) != 0 and self._fifo[-1][0] + self._fifo[-1][1] == self._produced:
+                    self._fifo[-1][1] += accepted
+                else:
+                    self._fifo.append([self._produced, accepted])
+
+                self._fifoSize += accepted
+
+            if accepted < new:
+                self.skipped += new - accepted
+                self._questionableEvent = True
+
+            self._produced = produced
+            self.maxFifo   = max(self.maxFifo, self._fifoSize)
+
+        if self._fifoSize >= self._options['chunk']:
+            self._operationEvent = True
+
+
+    def _arbValues(self, t):
+        # Source value of the arbitrary table at the host times t
+        rows        = self._arb
+        end         = numpy.cumsum(rows[:, 3])
+        period      = end[-1]
+        elapsed     = t - self._arbStart
+        repetitions = int(self._float('ARB:REP', 0))
+        index       = numpy.minimum(numpy.searchsorted(end, numpy.mod(elapsed, period), side = 'right'), rows.shape[0] - 1)
+        column      = 2 if self._settings.get('SOUR:PRI', 'VOLT').upper().startswith('CURR') else 0
+
+        if repetitions > 0:                 # The last point is held once the table has been played
+            index = numpy.where(elapsed >= repetitions * period, rows.shape[0] - 1, index)
+
+        return rows[index, column]
+
+
+    def _output(self, t):
+        # Voltage and current measured at the host times t
+        t = numpy.asarray(t, dtype = float)
+        v = numpy.zeros(t.shape)
+        i = numpy.zeros(t.shape)
+
+        on = self._outputOn is not None or self._outputOff is not None
+
+        if on:
+            start = self._outputOn if self._outputOn is not None else -numpy.inf
+            end   = self._outputOff if self._outputOff is not None else numpy.inf
+            live  = numpy.logical_and(t >= start, t < end)
+
+            if self._arb is not None and self._arbStart is not None:
+                value = self._arbValues(t)
+            else:
+                value = numpy.full(t.shape, self._float('SOUR:VOLT', 0.))
+
+            if self._settings.get('SOUR:PRI', 'VOLT').upper().startswith('CURR'):
+                i = numpy.where(live, value, 0.)
+                v = i * self._options['load']
+            else:
+                v = numpy.where(live, value, 0.)
+                i = v / self._options['load']
+
+        v = v + self._random.normal(0, self._options['noise'], t.shape)
+        i = i + self._random.normal(0, self._options['noise'], t.shape)
+
+        return v, i
+
+
+    def _float(self, header, default):
+        try:
+            return float(self._settings.get(header, default))
+        except ValueError:
+            return default
+
+
+    def _flogData(self):
+        self._update()
+
+        count = 0
+        start = 0
+
+        if len(self._fifo) != 0:
+            start, available = self._fifo[0]
+            count = min(available, self._options['block'])
+
+            if count == available:
+                self._fifo.popleft()
+            else:
+                self._fifo[0][0] += count
+                self._fifo[0][1] -= count
+
+            self._fifoSize -= count
+
+        v, i = self._output(self._flogStart + (start + numpy.arange(count)) / self._rate())
+
+        data = numpy.empty((count, 2), dtype = '<f4')
+        data[:, 0] = v
+        data[:, 1] = i
+
+        body   = data.tobytes()
+        length = str(len(body))
+
+        return '#{:d}{:s}'.format(len(length), length).encode('latin1') + body + b'\n'
+
+
+    def _outputState(self):
+        self._update()
+
+        return '1' if self._outputOn is not None else '0'
+
+
+    def _setOutput(self, state):
+        now = time.perf_counter()
+
+        if state:
+            self._outputOn  = now
+            self._outputOff = None
+
+            if self._arb is not None and self._settings.get('ARB:STAT', '0') == '1':
+                self._arbStart = now
+                repetitions    = int(self._float('ARB:REP', 0))
+
+                if repetitions > 0 and self._settings.get('ARB:BEH:END', 'OFF').upper() == 'OFF':
+                    self._outputOff = now + repetitions * self._arb[:, 3].sum()
+        else:
+            self._outputOn  = None
+            self._outputOff = None
+
+
+    def _execute(self, command):
+        responses = []
+
+        for part in command.strip().split(';'):
+            part = part.strip().lstrip(':')
+
+            if part == '':
+                continue
+
+            header, _, value = part.partition(' ')
+            header = header.upper()
+            value  = value.strip()
+
+            if header.endswith('?'):
+                response = self._query(header[:-1])
+
+                if isinstance(response, bytes):
+                    return response
+
+                responses.append(response)
+            else:
+                self._command(header, value)
+
+        return ';'.join(responses) if len(responses) != 0 else None
+
+
+    def _query(self, header):
+        if header == '*OPC':
+            return '1'
+        elif header == '*IDN':
+            return 'Rohde&Schwarz,NGU401,SIM,1.0'
+        elif header in ('OUTP', 'OUTP:STAT'):
+            return self._outputState()
+        elif header == 'READ':
+            self._update()
+            v, i = self._output(time.perf_counter())
+
+            return '{:.6E},{:.6E}'.format(float(v), float(i))
+        elif header == 'FLOG:DATA':
+            return self._flogData()
+        elif header == 'STAT:OPER:INST:ISUM1:EVEN':
+            event, self._operationEvent = self._operationEvent, False
+
+            return '4096' if event else '0'
+        elif header == 'STAT:QUES:INST:ISUM1:EVEN':
+            event, self._questionableEvent = self._questionableEvent, False
+
+            return '2048' if event else '0'
+        elif header in ('STAT:OPER:INST:EVEN', 'STAT:QUES:INST:EVEN'):
+            return '0'
+        elif header in ('STAT:OPER:EVEN', 'STAT:QUES:EVEN'):
+            return '0'
+        else:
+            return self._settings.get(header, '0')
+
+
+    def _command(self, header, value):
+        if header == '*RST':
+            self._reset()
+        elif header == '*CLS':
+            self._operationEvent    = False
+            self._questionableEvent = False
+        elif header in ('OUTP', 'OUTP:STAT'):
+            self._setOutput(value in ('1', 'ON'))
+        elif header == 'FLOG':
+            if value in ('1', 'ON'):
+                self._flogStart = time.perf_counter()
+                self._produced  = 0
+                self._fifo.clear()
+                self._fifoSize  = 0
+            else:
+                self._flogStart = None
+                self._operationEvent = False
+        elif header == 'ARB:DATA':
+            self._arbData = numpy.array([float(x) for x in value.split(',')]).reshape(-1, 5)
+        elif header == 'ARB:TRAN':
+            self._arb = self._arbData
+        elif header == 'ARB:CLE':
+            self._arb     = None
+            self._arbData = None
+        elif header == 'ARB:STAT':
+            self._settings[header] = '1' if value in ('1', 'ON') else '0'
+
+            if self._outputOn is not None and value in ('1', 'ON') and self._arb is not None:
+                self._setOutput(True)
+        else:
+            self._settings[header] = value
+
+
+def open(resource, timeout = 30_000):
+    parts   = resource.split('::')
+    options = {}
+
+    for part in parts[2:]:
+        key, _, value = part.partition('=')
+        options[key] = float(value)
+
+    if len(parts) > 1 and parts[1].upper() != 'NGU401':
+        raise ValueError('No simulator for {:s}'.format(resource))
+
+    for key in ('chunk', 'block', 'fifo'):
+        if key in options:
+            options[key] = int(options[key])
+
+    instrument = NGU401(resource, **options)
+    instrument.timeout = timeout
+
+    return instrument
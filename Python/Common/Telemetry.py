@@ -0,0 +1,99 @@
+import atexit
+import queue
+import sys
+import threading
+import time
+
+
+# Console output of the acquisition loops. publish() only puts the message in a queue, a writer thread does the console
+# I/O, so a slow terminal never delays the loop. Messages with a key are status lines: only the latest one of each key
+# is kept and they are written at most once per `interval`. Messages without a key are events and are all written.
+#
+#   Telemetry.publish('Remaining: {:.1f} s'.format(remaining), 'remaining')
+#   Telemetry.publish('Lost data!')
+#   Telemetry.flush()
+
+interval = 0.25             # Minimum time between two updates of the status lines
+capacity = 10_000           # Messages waiting to be written, further messages are dropped
+stream   = None             # Output stream, sys.stdout at the time of writing if None
+
+dropped = 0                 # Messages dropped because the queue was full
+
+_queue  = queue.Queue(capacity)
+_thread = None
+_lock   = threading.Lock()
+
+
+def _output():
+    return stream if stream is not None else sys.stdout
+
+
+def _write(lines):
+    if len(lines) != 0:
+        output = _output()
+        output.write(''.join(line + '\n' for line in lines))
+        output.flush()
+
+
+def _run():
+    pending   = {}
+    writeTime = 0
+
+    while True:
+        try:
+            key, message = _queue.get(timeout = interval)
+        except queue.Empty:
+            key, message = None, None
+
+        if isinstance(message, threading.Event):     # flush()
+            _write(list(pending.values()))
+            pending.clear()
+
+            message.set()
+            continue
+
+        if message is not None:
+            if key is None:
+                _write([message])
+            else:
+                pending[key] = message
+
+        if len(pending) != 0 and time.perf_counter() - writeTime >= interval:
+            _write(list(pending.values()))
+            pending.clear()
+
+            writeTime = time.perf_counter()
+
+
+def _start():
+    global _thread
+
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target = _run, daemon = True)
+            _thread.start()
+
+            atexit.register(flush)                  # The writer is a daemon thread, the last lines are written at exit
+
+
+def publish(message, key = None):
+    global dropped
+
+    if _thread is None:
+        _start()
+
+    try:
+        _queue.put_nowait((key, message))
+    except queue.Full:
+        dropped += 1
+
+
+def flush(timeout = 5):
+    # Waits until every message published so far, including the latest status lines, has been written
+    if _thread is None:
+        return
+
+    done = threading.Event()
+
+    _queue.put((None, done))
+    done.wait(timeout)
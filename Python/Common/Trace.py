@@ -0,0 +1,176 @@
+import time
+import numpy
+
+
+# Opt-in tracing of instrument sessions. A traced session records the duration of every transaction, grouped by command
+# header, and report() prints a histogram per header and a flame-style summary of where the wall time of the run went.
+# Sessions used from several threads overlap: their bars then add up to more than the run, the host time is what is left
+# out of the union of every transaction and sleep.
+#
+#   k2450 = Trace.wrap(k2450, 'K2450', trace)
+#   ...
+#   Trace.report()
+
+sessions  = []                      # Traced sessions, in the order they were opened
+sleeps    = []                      # (start, duration) of the Trace.sleep calls
+startTime = time.perf_counter()
+
+bins  = numpy.logspace(-5, 2, 15)   # Histogram bins from 10 us to 100 s, two per decade
+bars  = ' ▁▂▃▄▅▆▇█'
+width = 40                          # Width of the flame summary bars
+
+
+def header(command):
+    # SCPI header or TSP statement of each command of a compound command, without the parameters
+    return ';'.join(part.strip().split(' ', 1)[0] for part in command.strip().split(';'))
+
+
+class Session:
+    # Proxy of a pyvisa resource, every other attribute is passed through to the resource
+    def __init__(self, instrument, name):
+        self._instrument = instrument
+        self.name        = name
+        self.records     = []       # (method, header, start, duration)
+
+        sessions.append(self)
+
+
+    def __getattr__(self, attribute):
+        return getattr(self._instrument, attribute)
+
+
+    def _call(self, method, label, *args, **kwargs):
+        start  = time.perf_counter()
+        result = getattr(self._instrument, method)(*args, **kwargs)
+
+        self.records.append((method, label, start, time.perf_counter() - start))
+
+        return result
+
+
+    def write(self, command, *args, **kwargs):
+        return self._call('write', header(command), command, *args, **kwargs)
+
+
+    def query(self, command, *args, **kwargs):
+        return self._call('query', header(command), command, *args, **kwargs)
+
+
+    def query_binary_values(self, command, *args, **kwargs):
+        return self._call('query_binary_values', header(command), command, *args, **kwargs)
+
+
+    def read(self, *args, **kwargs):
+        return self._call('read', '', *args, **kwargs)
+
+
+    def read_raw(self, *args, **kwargs):
+        return self._call('read_raw', '', *args, **kwargs)
+
+
+    def read_stb(self):
+        return self._call('read_stb', '')
+
+
+    def clear(self):
+        return self._call('clear', '')
+
+
+    def wait_on_event(self, *args, **kwargs):
+        return self._call('wait_on_event', '', *args, **kwargs)
+
+
+def wrap(instrument, name, enabled = True):
+    return Session(instrument, name) if enabled else instrument
+
+
+def sleep(seconds):
+    start = time.perf_counter()
+    time.sleep(seconds)
+
+    sleeps.append((start, time.perf_counter() - start))
+
+
+def _union(intervals):
+    # Time covered by at least one of the (start, duration) intervals
+    covered = 0.
+    end     = None
+
+    for start, duration in sorted(intervals):
+        if end is None or start > end:
+            covered += duration
+            end      = start + duration
+        elif start + duration > end:
+            covered += start + duration - end
+            end      = start + duration
+
+    return covered
+
+
+def _histogram(durations):
+    # Durations outside of the bins are counted in the first or the last one
+    counts, _ = numpy.histogram(numpy.clip(durations, bins[0], bins[-1]), bins)
+
+    return ''.join(bars[int(numpy.ceil(8 * count / counts.max()))] for count in counts)
+
+
+def _bar(label, duration, total, depth):
+    size = int(round(width * duration / total)) if total > 0 else 0
+
+    print('{:s}{:<{:d}s} {:s}{:s} {:9.3f} s {:5.1f}%'.format('  ' * depth, label, 48 - 2 * depth, '█' * size,
+          ' ' * (width - size), duration, 100 * duration / total if total > 0 else 0))
+
+
+def report():
+    total = time.perf_counter() - startTime
+
+    # Histograms of the transaction durations by header
+
+    print('{:<10s} {:<20s} {:<40s} {:>7s} {:>9s} {:>9s} {:>9s} {:>9s}  {:s}'.format(
+        'Session', 'Method', 'Header', 'Count', 'Total s', 'Mean ms', 'p50 ms', 'p99 ms', '10 us .. 100 s'))
+
+    for session in sessions:
+        groups = {}
+
+        for method, command, _, duration in session.records:
+            groups.setdefault((method, command), []).append(duration)
+
+        for (method, command), durations in sorted(groups.items(), key = lambda item: -sum(item[1])):
+            durations = numpy.array(durations)
+            p50, p99  = numpy.percentile(durations, (50, 99)) * 1000
+
+            print('{:<10s} {:<20s} {:<40s} {:7d} {:9.3f} {:9.3f} {:9.3f} {:9.3f}  {:s}'.format(session.name, method,
+                  command[:40], durations.size, durations.sum(), durations.mean() * 1000, p50, p99, _histogram(durations)))
+
+    # Flame summary: run > session > method > header, by total time
+
+    print()
+
+    io   = sum(duration for session in sessions for _, _, _, duration in session.records)
+    busy = _union([(start, duration) for session in sessions for _, _, start, duration in session.records] + sleeps)
+
+    _bar('Run', total, total, 0)
+
+    for session in sessions:
+        methods = {}
+
+        for method, command, _, duration in session.records:
+            methods.setdefault(method, {}).setdefault(command, 0.)
+            methods[method][command] += duration
+
+        _bar(session.name, sum(sum(headers.values()) for headers in methods.values()), total, 1)
+
+        for method, headers in sorted(methods.items(), key = lambda item: -sum(item[1].values())):
+            _bar(method, sum(headers.values()), total, 2)
+
+            for command, duration in sorted(headers.items(), key = lambda item: -item[1]):
+                _bar(command[:40] if command != '' else '-', duration, total, 3)
+
+    sleep = sum(duration for _, duration in sleeps)
+
+    _bar('sleep', sleep, total, 1)
+    _bar('host', total - busy, total, 1)
+
+    if io + sleep > busy + 1e-6:
+        print('\nSessions overlap: {:.3f} s of instrument time and sleep ran concurrently, the bars add up to more than '
+              'the run'.format(io + sleep - busy))
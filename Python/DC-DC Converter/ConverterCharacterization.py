@@ -1,7 +1,18 @@
+import os
 import pyvisa
-import time
 import numpy
+import concurrent.futures
+import sys
+
 import Metric
+import Planner
+
+sys.path.append('../Common')
+
+import K2450
+import Range
+import Settling
+import Trace
 
 
 # Settings
@@ -18,17 +29,41 @@ iLimit = 1.0
 vSteps = 50
 iSteps = 50
 
-measurementDelay = 2
+measurementDelay = 2        # Maximum settling time of a point
+
+settlingTolerance = 1e-3                    # Relative spread allowed between the last readings
+settlingFloor     = (1e-3, 1e-6, 1e-3, 1e-6)  # Absolute spread always allowed for vIn, iIn, vOut, iOut
+settlingWindow    = 3                       # Consecutive readings that must agree
+
+parallel = True             # Read the K2450 and the NGU401 concurrently
+
+rangeLock = True            # Pin the readback ranges to the predicted readings, autorange only after an overflow
+
+bulk           = False      # Uniform sweep only: the K2450 steps through each column and returns it in a single query
+columnReadings = 8          # Maximum K2450 readings at a level for the input current to settle
+
+adaptive            = False     # Coarse grid refined where efficiency or output voltage change quickly
+coarseStride        = 8         # Grid steps between the points of the coarse grid
+efficiencyTolerance = 0.02      # Efficiency change across a cell that is not refined
+vOutTolerance       = 0.01      # Output voltage change across a cell that is not refined
+
+plan             = True         # Send SOUR:CURR:RANG only when the load current crosses a range boundary
+pointTime        = 1.0          # Expected time of a point for the wall time estimate, the resumed points are used if any
+rangeTime        = 0.2          # Time taken by a current range change
 
 filename = '../Data/DC-DC Converter/DCM2.npz'
 
+resume = False              # Skip the points already in filename when it was measured with the same grid, limits and mode
+
+trace = False               # Print the time spent in each instrument command at the end of the run
+
 
 # Code
 
 resourceManager = pyvisa.ResourceManager()
 
-k2450  = resourceManager.open_resource(k2450Resource, timeout = 30_000)
-ngu401 = resourceManager.open_resource(ngu401Resource, timeout = 30_000)
+k2450  = Trace.wrap(resourceManager.open_resource(k2450Resource, timeout = 30_000), 'K2450', trace)
+ngu401 = Trace.wrap(resourceManager.open_resource(ngu401Resource, timeout = 30_000), 'NGU401', trace)
 
 k2450.clear()
 ngu401.clear()
@@ -56,7 +91,7 @@ ngu401.write('SOUR:VOLT:NEG 0')
 ngu401.write('SOUR:VOLT 5.1')
 ngu401.query('*OPC?')
 ngu401.write('SOUR:CURR:RANG 0.001')
-time.sleep(.1)
+Trace.sleep(.1)
 ngu401.write('SOUR:CURR -25E-6')
 ngu401.write('SENS:CURR:RANG:AUTO 1')
 ngu401.write('SENS:VOLT:RANG:AUTO 1')
@@ -70,62 +105,293 @@ ngu401.query('*OPC?')
 vTable = numpy.linspace(vRange[0], vRange[1], vSteps)
 iTable = iRange[0] * numpy.power(numpy.power(iRange[1] / iRange[0], 1. / (iSteps - 1.)), numpy.arange(iSteps))
 
-data = numpy.zeros((vTable.size, iTable.size, 4))
+data     = numpy.zeros((vTable.size, iTable.size, 4))
+settling = numpy.zeros((vTable.size, iTable.size))         # Time each point took to settle, NaN if it did not
+state    = numpy.zeros((vTable.size, iTable.size), dtype = numpy.int8)
+
+mode = 'adaptive' if adaptive else 'bulk' if bulk else 'uniform'     # Sweep mode, saved to check a resume
+
+pendingPoint  = 0
+measuredPoint = 1
+skippedPoint  = 2           # Beyond the output voltage or input current limit
+
+
+def readInput():
+    k2450.write('smu.measure.read()')
+
+    vIn = float(k2450.query('print(defbuffer1.sourcevalues[defbuffer1.n])'))
+    iIn = float(k2450.query('print(defbuffer1[defbuffer1.n])'))
+
+    return vIn, iIn
+
+
+def readOutput():
+    query = ngu401.query('READ?')
+    ngu401.query('*OPC?')
+
+    vOut, iOut = [float(x) for x in query.split(',')]
+
+    return vOut, -iOut
+
+
+def readAll():
+    # Input from the K2450, output from the NGU401. The K2450 is read from a worker thread while the NGU401 is read,
+    # so a reading costs the slower of the two instruments.
+    if executor is None:
+        return readInput() + readOutput()
+
+    pending = executor.submit(readInput)
+    output  = readOutput()
 
+    return pending.result() + output
 
-for iIdx in range(iTable.size):
-    iOut = iTable[iIdx]
 
-    # Set output current
+def read(vSet):
+    # The load current is known, the input current is at least the output power over the input voltage and the output
+    # voltage follows the previous reading
+    if rangers is None:
+        return readAll()
 
-    ngu401.write('SOUR:CURR:RANG {:f}'.format(iOut))
-    time.sleep(.2)
-    ngu401.write('SOUR:CURR {:f}'.format(-iOut))
+    iIn = max(abs(rangers[1].last or 0), vLimit * iTable[currentIdx] / vSet)
+
+    return tuple(Range.read(readAll, rangers, (None, iIn, None, iTable[currentIdx])))
+
+
+def readLoad():
+    if rangers is None:
+        return readOutput()
+
+    return tuple(Range.read(readOutput, rangers[2 :], (None, iTable[currentIdx])))
+
+
+def setCurrent(iIdx):
+    global currentIdx
+
+    if iIdx == currentIdx:
+        return
+
+    if not plan or currentIdx is None or rangeIndex[iIdx] != rangeIndex[currentIdx]:
+        ngu401.write('SOUR:CURR:RANG {:f}'.format(iTable[iIdx]))
+        Trace.sleep(rangeTime)
+
+    ngu401.write('SOUR:CURR {:f}'.format(-iTable[iIdx]))
+
+    currentIdx = iIdx
+
+
+def measure(vIdx, iIdx):
+    # Measures a grid point, returns False if it is beyond the output voltage or input current limit
+    setCurrent(iIdx)
+
+    # Set input Voltage
+
+    k2450.write('smu.source.level = {:f}'.format(vTable[vIdx]))
+
+    # Read input and output until they settle
+
+    (vIn, iIn, vOut, iOut), elapsed, settled = Settling.settle(lambda: read(vTable[vIdx]), settlingTolerance, settlingFloor, settlingWindow, measurementDelay)
+
+    return store(vIdx, iIdx, vIn, iIn, vOut, iOut, elapsed, settled)
+
+
+def measureColumn(iIdx):
+    # The K2450 steps through the pending points of the column, from the highest input voltage down, and returns them
+    # with a single query. The output is settled on the host before the K2450 is triggered, the input current is settled
+    # by the K2450 itself, which also ends the column once the input current is over iLimit.
+    points = []
 
     for vIdx in reversed(range(vTable.size)):
-        vIn = vTable[vIdx]
- 
-        # Set input Voltage
+        if state[vIdx, iIdx] == skippedPoint:
+            break
+
+        if state[vIdx, iIdx] == pendingPoint:
+            points.append(vIdx)
+
+    if len(points) == 0:
+        return
+
+    setCurrent(iIdx)
+
+    ready  = column.start(vTable[points])
+    output = []
 
-        k2450.write('smu.source.level = {:f}'.format(vIn))
-        
-        time.sleep(measurementDelay)
+    for vIdx in points:
+        if not ready:
+            break
 
-        # Read input
+        (vOut, iOut), elapsed, settled = Settling.settle(readLoad, settlingTolerance, settlingFloor[2 :], settlingWindow, measurementDelay)
 
-        k2450.write('smu.measure.read()')
+        output.append((vOut, iOut, elapsed, settled))
+        ready = column.trigger()
 
-        vIn = float(k2450.query('print(defbuffer1.sourcevalues[defbuffer1.n])'))
-        iIn = float(k2450.query('print(defbuffer1[defbuffer1.n])'))
+        if vOut < vLimit:
+            break
 
-        # Read Output
+    if ready:
+        column.stop()                               # Column ended on the host, the script waits at the next level
 
-        query = ngu401.query('READ?')
-        ngu401.query('*OPC?')
-        
-        vOut, iOut = [float(x) for x in query.split(',')]
-        iOut = -iOut
+    readings = column.fetch()
 
-        # Print
-        
-        vin  = Metric.metric(vIn, 3, 'V')
-        inn  = Metric.metric(iIn, 3, 'A')
-        pin  = Metric.metric(vIn * iIn, 3, 'W')
-        vout = Metric.metric(vOut, 3, 'V')
-        iout = Metric.metric(iOut, 3, 'A')
-        pout = Metric.metric(vOut * iOut, 3, 'W')
+    for index, (vIdx, (vOut, iOut, elapsed, settled)) in enumerate(zip(points, output)):
+        if index >= readings.shape[0]:
+            state[vIdx, iIdx] = skippedPoint        # Reading lost when the script was stopped
+            break
 
-        print('Input: {:s}, {:s}, {:s}, Output: {:s}, {:s}, {:s}, Effiency: {:.1f}%'.format(vin, inn, pin, vout, iout, pout, 100 * (vOut * iOut) / (vIn * iIn)))
+        vIn, iIn, inputSettled = readings[index]
 
-        if vOut < vLimit or iIn > iLimit:
+        if not store(vIdx, iIdx, vIn, iIn, vOut, iOut, elapsed, settled and inputSettled != 0):
             break
 
+
+def store(vIdx, iIdx, vIn, iIn, vOut, iOut, elapsed, settled):
+    # Prints and stores a point, returns False if it is beyond the output voltage or input current limit
+
+    # Print
+
+    vin  = Metric.metric(vIn, 3, 'V')
+    inn  = Metric.metric(iIn, 3, 'A')
+    pin  = Metric.metric(vIn * iIn, 3, 'W')
+    vout = Metric.metric(vOut, 3, 'V')
+    iout = Metric.metric(iOut, 3, 'A')
+    pout = Metric.metric(vOut * iOut, 3, 'W')
+
+    print('Input: {:s}, {:s}, {:s}, Output: {:s}, {:s}, {:s}, Effiency: {:.1f}%, Settling: {:.2f} s{:s}'.format(vin, inn, pin, vout, iout, pout, 100 * (vOut * iOut) / (vIn * iIn), elapsed, '' if settled else ' (timeout)'))
+
+    if vOut < vLimit or iIn > iLimit:
+        state[vIdx, iIdx] = skippedPoint
+    else:
         data[vIdx, iIdx, 0] = vIn
         data[vIdx, iIdx, 1] = iIn
         data[vIdx, iIdx, 2] = vOut
         data[vIdx, iIdx, 3] = iOut
 
+        settling[vIdx, iIdx] = elapsed if settled else numpy.nan
+
+        state[vIdx, iIdx] = measuredPoint
+
+    save()
+
+    return state[vIdx, iIdx] == measuredPoint
+
+
+def save():
+    # Written after every point through a temporary file, so an interrupted run leaves a complete file to resume from
+    points = numpy.argwhere(state != pendingPoint)
+
+    with open(filename + '.tmp', 'wb') as file:
+        numpy.savez(file, data = data, vTable = vTable, iTable = iTable, settling = settling, state = state, adaptive = adaptive,
+                    vLimit = vLimit, iLimit = iLimit, mode = mode,
+                    points = numpy.column_stack((vTable[points[:, 0]], iTable[points[:, 1]])), values = data[state != pendingPoint])
+
+    os.replace(filename + '.tmp', filename)
+
+
+def measureAll(points):
+    # Points of a column are measured together, from the highest input voltage down. Once a point is beyond the limits,
+    # every lower voltage of its column is skipped, as in the uniform sweep, so the converter is never driven further
+    # into undervoltage lockout or toward the current compliance.
+    for vIdx, iIdx in sorted(set(points), key = lambda point: (point[1], -point[0])):
+        if state[vIdx, iIdx] == pendingPoint and not measure(vIdx, iIdx):
+            lower = state[: vIdx, iIdx]
+            lower[lower == pendingPoint] = skippedPoint
+
+            save()
+
+
+def refine(v0, v1, i0, i1):
+    # A cell is split where the limits are crossed or where efficiency or output voltage change too much across it
+    corners = numpy.ix_([v0, v1], [i0, i1])
+    valid   = data[:, :, 2][corners] != 0
+
+    if not valid.any():
+        return False
+
+    if not valid.all():
+        return True
+
+    pIn  = data[:, :, 0][corners] * data[:, :, 1][corners]
+    pOut = data[:, :, 2][corners] * data[:, :, 3][corners]
+
+    return numpy.ptp(pOut / pIn) > efficiencyTolerance or numpy.ptp(data[:, :, 2][corners]) > vOutTolerance
+
+
+currentIdx = None
+rangers    = [None, Range.k2450(k2450), Range.ngu401(ngu401, 'VOLT'), Range.ngu401(ngu401, 'CURR')] if rangeLock else None
+rangeIndex = Planner.ranges(iTable, Range.ngu401Current)
+executor   = concurrent.futures.ThreadPoolExecutor(max_workers = 1) if parallel else None
+
+if resume and os.path.exists(filename):
+    with numpy.load(filename) as file:
+        if 'mode' in file and numpy.array_equal(file['vTable'], vTable) and numpy.array_equal(file['iTable'], iTable) and \
+           file['vLimit'] == vLimit and file['iLimit'] == iLimit and str(file['mode']) == mode:
+            data     = file['data']
+            settling = file['settling']
+            state    = file['state']
+
+            print('Resuming, {:d} of {:d} points already measured, {:d} beyond the limits'.format(
+                  numpy.count_nonzero(state == measuredPoint), state.size, numpy.count_nonzero(state == skippedPoint)))
+        else:
+            print('Not resuming, {:s} was measured with another grid, other limits or another mode'.format(filename))
+
+if numpy.any(numpy.isfinite(settling[state == measuredPoint])):
+    pointTime = numpy.nanmedian(settling[state == measuredPoint])
+
+if not adaptive and not bulk:
+    estimatedTime, pendingPoints, rangeChanges = Planner.estimate(state, pendingPoint, rangeIndex, pointTime, rangeTime, plan)
+
+    print('Estimated wall time: at most {:.1f} min for {:d} points and {:d} range changes'.format(estimatedTime / 60, pendingPoints, rangeChanges))
+
+if not adaptive and bulk:
+    column = K2450.Column(k2450, measurementDelay + 5, settlingWindow, columnReadings, settlingTolerance, settlingFloor[1], iLimit)
+
+    for iIdx in range(iTable.size):
+        measureColumn(iIdx)
+elif not adaptive:
+    for iIdx in range(iTable.size):
+        for vIdx in reversed(range(vTable.size)):
+            if state[vIdx, iIdx] == pendingPoint:
+                measure(vIdx, iIdx)
+
+            if state[vIdx, iIdx] == skippedPoint:
+                break
+else:
+    # Coarse grid first, then every cell that needs it is split in four until cells are one step wide
+
+    vCoarse = numpy.unique(numpy.append(numpy.arange(0, vTable.size, coarseStride), vTable.size - 1))
+    iCoarse = numpy.unique(numpy.append(numpy.arange(0, iTable.size, coarseStride), iTable.size - 1))
+
+    measureAll([(vIdx, iIdx) for vIdx in vCoarse for iIdx in iCoarse])
+
+    cells = [(v0, v1, i0, i1) for v0, v1 in zip(vCoarse[: -1], vCoarse[1 :]) for i0, i1 in zip(iCoarse[: -1], iCoarse[1 :])]
+
+    while len(cells) != 0:
+        cells = [cell for cell in cells if cell[1] - cell[0] > 1 or cell[3] - cell[2] > 1]
+        cells = [cell for cell in cells if refine(*cell)]
+
+        split = []
+
+        for v0, v1, i0, i1 in cells:
+            vm = (v0 + v1) // 2 if v1 - v0 > 1 else v0
+            im = (i0 + i1) // 2 if i1 - i0 > 1 else i0
+
+            vEdges = sorted(set((v0, vm, v1)))
+            iEdges = sorted(set((i0, im, i1)))
+
+            split += [(va, vb, ia, ib) for va, vb in zip(vEdges[: -1], vEdges[1 :]) for ia, ib in zip(iEdges[: -1], iEdges[1 :])]
+
+        measureAll([(vIdx, iIdx) for v0, v1, i0, i1 in split for vIdx in (v0, v1) for iIdx in (i0, i1)])
+
+        cells = split
+
+    print('Measured {:d} of {:d} points'.format(numpy.count_nonzero(state == measuredPoint), state.size))
+
+if executor is not None:
+    executor.shutdown()
+
 ngu401.write('OUTP:STAT 0')
 k2450.write('smu.source.output = smu.OFF')
 
-numpy.savez(filename, data = data, vTable = vTable, iTable = iTable)
\ No newline at end of file
+save()
+
+if trace:
+    Trace.report()
\ No newline at end of file
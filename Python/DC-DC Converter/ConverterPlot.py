@@ -1,33 +1,92 @@
+import os
+import json
+import hashlib
+import concurrent.futures
 import numpy
+import scipy.interpolate as interpolate
+import matplotlib
+
+matplotlib.use('Agg')                       # Figures are only saved, the workers have no display
+
 import matplotlib.pyplot as pyplot
 import matplotlib.colors as colors
 
 
 # Settings
 
-input            = '../Data/DC-DC Converter/PWM.npz'
-outputPin        = '../Data/DC-DC Converter/PWM_Power.png'
-outputVout       = '../Data/DC-DC Converter/PWM_Voltage.png'
-outputEfficiency = '../Data/DC-DC Converter/PWM_Efficiency.png'
-title = 'PWM'
+datasets = \
+[
+    ('../Data/DC-DC Converter/PWM.npz', 'PWM'),
+    ('../Data/DC-DC Converter/PFM.npz', 'PFM'),
+    ('../Data/DC-DC Converter/DCM.npz', 'DCM'),
+]
 
-input            = '../Data/DC-DC Converter/PFM.npz'
-outputPin        = '../Data/DC-DC Converter/PFM_Power.png'
-outputVout       = '../Data/DC-DC Converter/PFM_Voltage.png'
-outputEfficiency = '../Data/DC-DC Converter/PFM_Efficiency.png'
-title = 'PFM'
+# Output suffix, quantity, colormap, log scale, colorbar min, colorbar max, colorbar label, contour levels, contour threshold
 
-input            = '../Data/DC-DC Converter/DCM.npz'
-outputPin        = '../Data/DC-DC Converter/DCM_Power.png'
-outputVout       = '../Data/DC-DC Converter/DCM_Voltage.png'
-outputEfficiency = '../Data/DC-DC Converter/DCM_Efficiency.png'
-title = 'DCM'
+figures = \
+[
+    ('Efficiency', 'efficiency', 'inferno', False, 0.,    1.,  'Efficiency',         [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95], 0.5),
+    ('Power',      'pIn',        'inferno', True,  0.001, 15,  'Input power (W)',    [0.01, 0.1, 1.0, 10], 0.5),
+    ('Voltage',    'vOut',       'seismic', False, 4.9,   5.1, 'Output voltage (V)', [5], 4),
+]
 
-size   = (6, 4.5)
+size = (6, 4.5)
+dpi  = 300
+
+workers = None              # Processes rendering the figures, one per CPU by default
+cache   = '../Data/DC-DC Converter/ConverterPlot.json'   # Key of every figure rendered, figures with the same key are skipped
 
 
 # Function
 
+def grid(points, values, vTable, iTable):
+    # Scattered points of an adaptive sweep on the vTable x iTable grid, interpolated linearly in vIn and log(iOut).
+    # Points beyond the limits hold zeros, the grid cells closest to them are left at zero.
+    x    = numpy.column_stack((points[:, 0], numpy.log10(points[:, 1])))
+    v, i = numpy.meshgrid(vTable, numpy.log10(iTable), indexing = 'ij')
+
+    valid  = values[:, 2] != 0
+    inside = interpolate.griddata(x, valid.astype(float), (v, i), method = 'nearest') > 0.5
+
+    data = interpolate.griddata(x[valid], values[valid], (v, i), method = 'linear', fill_value = 0)
+    data[numpy.logical_not(inside)] = 0
+
+    return data
+
+
+def load(input):
+    # Grid tables and the quantities that can be plotted, points beyond the limits are NaN
+    with numpy.load(input) as file:
+        data   = file['data']
+        vTable = file['vTable']
+        iTable = file['iTable']
+
+        if 'adaptive' in file and file['adaptive']:
+            data = grid(file['points'], file['values'], vTable, iTable)
+
+    vIn  = data[:, :, 0]
+    iIn  = data[:, :, 1]
+    pIn  = vIn * iIn
+
+    vOut = data[:, :, 2]
+    iOut = data[:, :, 3]
+    pOut = vOut * iOut
+
+    vIn[vIn == 0] = numpy.nan
+    iIn[iIn == 0] = numpy.nan
+    pIn[pIn == 0] = numpy.nan
+
+    vOut[vOut == 0] = numpy.nan
+    iOut[iOut == 0] = numpy.nan
+    pOut[pOut == 0] = numpy.nan
+
+    efficiency = numpy.empty(data.shape[0 : 2])
+    efficiency[:] = numpy.nan
+    efficiency[pIn != 0] = pOut[pIn != 0] / pIn[pIn != 0]
+
+    return vTable, iTable, {'efficiency': efficiency, 'pIn': pIn, 'vOut': vOut}
+
+
 def plot(vTable, iTable, quantity, title, cmap, logBar, minBar, maxBar, barLabel, contourLevels, contourThreshold, width = size[0], height = size[1]):
     fig, ax = pyplot.subplots()
     pyplot.gcf().set_size_inches(width, height)
@@ -36,10 +95,10 @@ def plot(vTable, iTable, quantity, title, cmap, logBar, minBar, maxBar, barLabel
         pyplot.pcolormesh(iTable, vTable, quantity, shading = 'auto', cmap = cmap, norm = colors.LogNorm(vmin = minBar, vmax = maxBar))
     else:
         pyplot.pcolormesh(iTable, vTable, quantity, shading = 'auto', cmap = cmap, vmin = minBar, vmax = maxBar)
-        
+
     pyplot.xscale('log')
 
-    pyplot.xticks([1e-4, 1e-3, 1e-2, 1e-1, 1], ['100$\mu$', '1m', '10m', '100m', '1'])
+    pyplot.xticks([1e-4, 1e-3, 1e-2, 1e-1, 1], ['100$\\mu$', '1m', '10m', '100m', '1'])
 
     pyplot.xlabel('$I_{out}$ (A)', fontsize = 15)
     pyplot.ylabel('$V_{in}$ (V)', fontsize = 15)
@@ -48,53 +107,73 @@ def plot(vTable, iTable, quantity, title, cmap, logBar, minBar, maxBar, barLabel
     cb.set_label(label = barLabel, size = 15)
 
     if len(contourLevels) != 0:
-        cs = pyplot.contour(iTable, vTable, quantity, contourLevels, colors = ['w' if x <= contourThreshold else 'k' for x in levels])
+        cs = pyplot.contour(iTable, vTable, quantity, contourLevels, colors = ['w' if x <= contourThreshold else 'k' for x in contourLevels])
         ax.clabel(cs, inline = True, inline_spacing = 5, fontsize = 10)
 
     pyplot.title(title, fontsize = 18)
 
+    return fig
 
-# Code
 
-file = numpy.load(input)
+def output(input, suffix):
+    # PWM.npz gives PWM_Efficiency.png, next to the data
+    return os.path.splitext(input)[0] + '_' + suffix + '.png'
+
+
+def key(input, title, figure):
+    # Hash of the source data and of everything that changes the figure
+    digest = hashlib.sha1()
+
+    with open(input, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
 
-data   = file['data']
-vTable = file['vTable']
-iTable = file['iTable']
+    digest.update(repr((title, figure, size, dpi)).encode())
 
-vIn  = data[:, :, 0]
-iIn  = data[:, :, 1]
-pIn  = vIn * iIn
+    return digest.hexdigest()
 
-vOut = data[:, :, 2]
-iOut = data[:, :, 3]
-pOut = vOut * iOut
 
-vIn[vIn == 0] = numpy.NaN
-iIn[iIn == 0] = numpy.NaN
-pIn[pIn == 0] = numpy.NaN
+def render(input, title, figure):
+    # Runs in a worker process
+    suffix, name, cmap, logBar, minBar, maxBar, barLabel, contourLevels, contourThreshold = figure
+
+    vTable, iTable, quantities = load(input)
+
+    fig = plot(vTable, iTable, quantities[name], title, cmap, logBar, minBar, maxBar, barLabel, numpy.array(contourLevels), contourThreshold)
+    fig.savefig(output(input, suffix), dpi = dpi)
+    pyplot.close(fig)
+
+    return output(input, suffix)
+
+
+# Code
+
+if __name__ == '__main__':
+    rendered = {}
 
-vOut[vOut == 0] = numpy.NaN
-iOut[iOut == 0] = numpy.NaN
-pOut[pOut == 0] = numpy.NaN
+    if os.path.exists(cache):
+        with open(cache) as file:
+            rendered = json.load(file)
 
-efficiency = numpy.empty(data.shape[0 : 2])
-efficiency[:] = numpy.NaN
-efficiency[pIn != 0] = pOut[pIn != 0] / pIn[pIn != 0]
+    jobs = []
 
-levels = numpy.array([0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
-plot(vTable, iTable, efficiency, title, 'inferno', False, 0., 1., 'Efficiency', levels, 0.5)
-pyplot.savefig(outputEfficiency, dpi = 300)
-pyplot.clf()
+    for input, title in datasets:
+        for figure in figures:
+            figureKey = key(input, title, figure)
 
-levels = numpy.array([0.01, 0.1, 1.0, 10])
-plot(vTable, iTable, pIn, title, 'inferno', True, 0.001, 15, 'Input power (W)', levels, 0.5)
-pyplot.savefig(outputPin, dpi = 300)
-pyplot.clf()
+            if rendered.get(output(input, figure[0])) == figureKey and os.path.exists(output(input, figure[0])):
+                print('Unchanged: {:s}'.format(output(input, figure[0])))
+            else:
+                jobs.append((input, title, figure, figureKey))
 
-levels = numpy.array([5])
-plot(vTable, iTable, vOut, title, 'seismic', False, 4.9, 5.1, 'Output voltage (V)', levels, 4)
-pyplot.savefig(outputVout, dpi = 300)
-pyplot.clf()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = {executor.submit(render, input, title, figure): figureKey for input, title, figure, figureKey in jobs}
 
+            for future in concurrent.futures.as_completed(futures):
+                rendered[future.result()] = futures[future]
 
+                print('Rendered: {:s}'.format(future.result()))
+    finally:
+        with open(cache, 'w') as file:                  # The figures rendered before a failure are not rendered again
+            json.dump(rendered, file, indent = 4)
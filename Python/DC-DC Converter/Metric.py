@@ -1,32 +1,71 @@
+import bisect
+import functools
+import math
+import numpy
+
+
+factor = [10. ** exponent for exponent in range(24, -25, -3)]
+prefix = ['Y', 'Z', 'E', 'P', 'T', 'G', 'M', 'k', '', 'm', 'µ', 'n', 'p', 'f', 'a', 'z', 'y']
+
+_ascending = factor[::-1]
+
+
+@functools.lru_cache(maxsize = None)
+def _format(decimal, plus):
+    return '%{:s}.{:d}f'.format('+' if plus else '', decimal)
+
+
+def _scalar(value, digit, unit, plus):
+    # Same as the array path without the numpy overhead, for the live readouts. The prefix is the largest factor not
+    # above the value, found by bisection instead of log10.
+    magnitude = abs(value)
+    index     = 8
+
+    if magnitude != 0 and math.isfinite(magnitude):
+        index     = min(len(factor) - bisect.bisect_right(_ascending, magnitude), len(factor) - 1)
+        value     = value / factor[index]
+        magnitude = abs(value)
+    elif magnitude == 0:
+        value = 0.
+
+    decimal = max(digit - 1 - (magnitude >= 10.0) - (magnitude >= 100.0), 0)
+
+    return _format(decimal, plus) % value + ' ' + prefix[index] + unit
+
+
 def metric(value, digit, unit, plus = False):
-    factor = [1E24, 1E21, 1E18, 1E15, 1E12, 1E9, 1E6, 1E3, 1, 1E-3, 1E-6, 1E-9, 1E-12, 1E-15, 1E-18, 1E-21, 1E-24]
-    prefix = ['Y', 'Z', 'E', 'P', 'T', 'G', 'M', 'k', '', 'm', '\u00B5', 'n', 'p', 'f', 'a', 'z', 'y']
-
-    if plus:
-        plusString = '+'
-    else:
-        plusString = ''
-
-    if value < 0:
-        sign = -1.0
-    else:
-        sign = 1.0
-
-    value = abs(value)
-
-    if value == 0:
-        i = 8
-    else:
-        for i in range(len(factor)):
-            if value >= factor[i]:
-                value /= factor[i]
-                break
-
-    if value >= 100.0:
-        decimal = digit - 3
-    elif value >= 10.0:
-        decimal = digit - 2
-    else:
-        decimal = digit - 1
-
-    return '{{:{:s}.{:d}f}} {{:s}}{{:s}}'.format(plusString, decimal).format(sign * value, prefix[i], unit)
+    # Scalar or array, the prefix of every value is chosen in a single log10 pass and the values sharing a number of
+    # decimals are formatted together. Returns a string for a scalar and an array of strings for an array.
+    if isinstance(value, (int, float)):             # Python and numpy floats, before any numpy call
+        return _scalar(float(value), digit, unit, plus)
+
+    if numpy.ndim(value) == 0:
+        return _scalar(float(value), digit, unit, plus)
+
+    values = numpy.asarray(value, dtype = float)
+
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        exponent = numpy.floor(numpy.log10(numpy.abs(values)) / 3)
+
+    exponent = numpy.where(numpy.isfinite(exponent), exponent, 0).astype(int)
+    exponent = numpy.clip(exponent, -8, 8)
+    scaled   = numpy.where(values == 0, 0., values / numpy.take(factor, 8 - exponent))
+
+    # log10 may land on the wrong side of a power of 1000
+
+    magnitude = numpy.abs(scaled)
+    exponent  = exponent - ((magnitude < 1) & (magnitude > 0) & (exponent > -8)) + ((magnitude >= 1000) & (exponent < 8))
+    scaled    = numpy.where(values == 0, 0., values / numpy.take(factor, 8 - exponent))
+    magnitude = numpy.abs(scaled)
+
+    decimal = numpy.maximum(digit - 1 - (magnitude >= 10.0) - (magnitude >= 100.0), 0)
+
+    text = numpy.empty(values.shape, dtype = object)
+
+    for d in numpy.unique(decimal):
+        mask       = decimal == d
+        text[mask] = numpy.char.mod(_format(int(d), plus), scaled[mask])
+
+    text = numpy.char.add(numpy.char.add(text.astype(str), ' '), numpy.char.add(numpy.take(prefix, 8 - exponent), unit))
+
+    return text
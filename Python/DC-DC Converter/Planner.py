@@ -0,0 +1,25 @@
+import numpy
+
+
+# Sweep planning for ConverterCharacterization. Columns (output currents) are measured in increasing order so the load
+# current range only changes at range boundaries. Every column is swept from the highest input voltage down and stops at
+# the first point beyond the limits: coming from below, the converter would start inside its undervoltage lockout
+# hysteresis and trip differently depending on the direction.
+
+
+def ranges(iTable, currentRanges):
+    # Index of the range selected for each current
+    return numpy.searchsorted(currentRanges, iTable)
+
+
+def estimate(state, pendingPoint, rangeIndex, pointTime, rangeTime, plan):
+    # Upper bound of the sweep time: every pending point is measured
+    columns = numpy.nonzero((state == pendingPoint).any(axis = 0))[0]
+    points  = numpy.count_nonzero(state == pendingPoint)
+
+    if plan:
+        changes = numpy.count_nonzero(numpy.diff(rangeIndex[columns])) + (columns.size != 0)
+    else:
+        changes = columns.size
+
+    return points * pointTime + changes * rangeTime, points, changes
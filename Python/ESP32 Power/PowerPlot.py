@@ -1,11 +1,17 @@
 import numpy
 import matplotlib.pyplot as pyplot
 import scipy.signal as signal
+import sys
+
+sys.path.append('../Common')
+
+import Capture
+import Clock
 
 
 # Settings
 
-smuInput    = '../Data/ESP32 Power/power.npz'
+smuInput    = '../Data/ESP32 Power/power.npy'   # Streamed capture (.npy) or legacy .npz
 scopeInput  = '../Data/ESP32 Power/scope.npz'
 rawOutput   = '../Data/ESP32 Power/raw.png'
 powerOutput = '../Data/ESP32 Power/power.png'
@@ -15,10 +21,10 @@ size = (12, 6)
 
 # Precomputation
 
-file = numpy.load(smuInput)
+vBuffer, iBuffer = Capture.load(smuInput)
 
-vBuffer  = file['vBuffer']
-iBuffer  = file['iBuffer']
+vBuffer = Clock.expand(vBuffer, Capture.gaps(smuInput))    # Uniformly sampled, the samples lost during the capture are NaN
+iBuffer = Clock.expand(iBuffer, Capture.gaps(smuInput))
 
 file = numpy.load(scopeInput)
 
@@ -41,8 +47,8 @@ posEdge = tScope[numpy.where(numpy.diff(ch2) > 0)[0]]
 negEdge = tScope[numpy.where(numpy.diff(ch2) < 0)[0]]
 
 edge = numpy.where(numpy.diff(vBuffer > 2.5) != 0)[0]
-rate = (edge[1] - edge[0]) / duration
-tSmu = (numpy.arange(iBuffer.size) - edge[0]) / rate 
+rate = Capture.rate(smuInput, (edge[1] - edge[0]) / duration)     # Captures without a sample clock use the GPIO edges
+tSmu = (numpy.arange(iBuffer.size) - edge[0]) / rate
 
 # Print measurements
 
@@ -78,9 +84,9 @@ for i in range(12):
         t0 = tSmu[idx0]
         t1 = tSmu[idx1]
 
-    current = iBuffer[idx0 : idx1].mean()
+    current = numpy.nanmean(iBuffer[idx0 : idx1], dtype = numpy.float64)     # Float64 accumulator, the trace stays float32
     charge  = current * (t1 - t0)
-    power   = (iBuffer[idx0 : idx1] * vBuffer[idx0 : idx1]).mean()
+    power   = numpy.nanmean(iBuffer[idx0 : idx1] * vBuffer[idx0 : idx1], dtype = numpy.float64)
     energy  = power * (t1 - t0)
 
     print('{:20s} : {:6.1f} ms, {:5.1f} mA, {:5.1f} mC, {:5.1f} mW, {:6.1f} mJ'.format(phase[i % 12], (t1 - t0) * 1000., current * 1000., charge * 1000., power * 1000., energy * 1000.))
@@ -88,8 +94,8 @@ for i in range(12):
 
 # Plot synchronized graph
 
-pyplot.plot(tSmu, vBuffer / vBuffer.max() * 0.9 + 0)
-pyplot.plot(tSmu, iBuffer / iBuffer.max() * 0.9 + 1)
+pyplot.plot(tSmu, vBuffer / numpy.nanmax(vBuffer) * 0.9 + 0)
+pyplot.plot(tSmu, iBuffer / numpy.nanmax(iBuffer) * 0.9 + 1)
 pyplot.plot(tScope, ch1 * 0.4 + 2)
 pyplot.plot(tScope, ch2 * 0.4 + 2.5)
 
@@ -115,7 +121,7 @@ idx1 = numpy.argmax(tSmu > posEdge[12])
 
 pyplot.plot(tSmu[idx0 : idx1], iBuffer[idx0 : idx1] * vBuffer[idx0 : idx1])
 
-top = iBuffer[idx0 : idx1].max()
+top = numpy.nanmax(iBuffer[idx0 : idx1])
 
 for i in range(13):
     t = (posEdge[i] + negEdge[i]) / 2
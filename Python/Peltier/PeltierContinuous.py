@@ -1,7 +1,14 @@
-import pyvisa
 import numpy
 import time
 import matplotlib.pyplot as pyplot
+import sys
+
+sys.path.append('../Common')
+
+import Instrument
+import Range
+import Telemetry
+import Trace
 
 import Temperature
 
@@ -17,13 +24,17 @@ v1   = +5                  # Final swepp voltage
 stepNumber   = 21          # Number of steps
 stepDuration = (180, 120)  # Time duration of the first and the remaining steps
 
+rangeLock = True           # Pin the readback ranges to the setpoint and the previous reading, autorange after an overflow
+
 filename = '../Data/peltier/Continuous.npz'
 
+trace = False               # Print the time spent in each instrument command at the end of the run
+
 
 # Code
 temperature = Temperature.Temperature(temperaturePort)
 
-ngu401 = pyvisa.ResourceManager().open_resource(resource, timeout = 30_000)
+ngu401 = Instrument.open(resource, trace = trace, name = 'NGU401')
 ngu401.clear()
 
 ngu401.write('*RST')
@@ -37,6 +48,16 @@ ngu401.write('SENS:NPLC 1')
 ngu401.write('OUTP 1')
 ngu401.query('*OPC?')
 
+rangers = [Range.ngu401(ngu401, 'VOLT'), Range.ngu401(ngu401, 'CURR')] if rangeLock else None
+
+
+def read():
+    query = ngu401.query('READ?')
+    ngu401.query('*OPC?')
+
+    return [float(x) for x in query.split(',')]
+
+
 vBuffer = []
 iBuffer = []
 tBuffer = []
@@ -54,10 +75,7 @@ for index in range(voltage.size):
     stepTime = time.time()
 
     while True:
-        query = ngu401.query('READ?')
-        ngu401.query('*OPC?')
-
-        v, i = [float(x) for x in query.split(',')]
+        v, i = read() if rangers is None else Range.read(read, rangers, (voltage[index], None))
         
         t = numpy.array(temperature.read()).mean()
         
@@ -66,7 +84,7 @@ for index in range(voltage.size):
         if startTime == 0:
             startTime = currentTime
 
-        print('[{:.1f} s] Voltage: {:.3f}, Current {:.3f}, Power: {:.3f} W, Temperature {:.3f} ºC'.format(currentTime - startTime, v, i, v * i, t))
+        Telemetry.publish('[{:.1f} s] Voltage: {:.3f}, Current {:.3f}, Power: {:.3f} W, Temperature {:.3f} ºC'.format(currentTime - startTime, v, i, v * i, t), 'reading')
 
         vBuffer.append(v)
         iBuffer.append(i)
@@ -81,3 +99,6 @@ for index in range(voltage.size):
 ngu401.write('OUTP 0')
 
 numpy.savez(filename, vBuffer = vBuffer, iBuffer = iBuffer, tBuffer = tBuffer, tmBuffer = tmBuffer)
+
+if trace:
+    Trace.report()
@@ -67,7 +67,7 @@ for i in range(where.size):
 
 # Pulse preprocessing
 
-diff  = numpy.diff((numpy.abs(pulseV) > numpy.mean(numpy.abs(pulseV)) * 100).astype(float))
+diff  = numpy.diff((numpy.abs(pulseV) > numpy.mean(numpy.abs(pulseV)) * 100).astype(numpy.int8))
 
 where = numpy.where(diff != 0)[0]
 where = (where[diff[where] > 0] + where[diff[where] < 0]) // 2
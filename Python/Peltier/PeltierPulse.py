@@ -1,7 +1,17 @@
-import pyvisa
 import numpy
 import scipy.interpolate as interpolate
-import time
+import sys
+
+sys.path.append('../Common')
+
+import Arb
+import Capture
+import Clock
+import FastLog
+import Instrument
+import Profile
+import Telemetry
+import Trace
 
 import Temperature
 
@@ -21,129 +31,77 @@ stepDuration = (0.001, 1)  # duration of the pulse and the time between pulses
 
 
 filename = '../Data/Peltier/pulse.npz'
+compress = False       # Lossless compressed .npz for archival
+
+trace = False               # Print the time spent in each instrument command at the end of the run
 
 
 # Code
 
 temperature = Temperature.Temperature(temperaturePort)
 
-ngu401 = pyvisa.ResourceManager().open_resource(resource, timeout = 30_000)
+ngu401 = Instrument.open(resource, trace = trace, name = 'NGU401')
 ngu401.clear()
 
-ngu401.write('*RST')
-ngu401.query('*OPC?')
-
-ngu401.write('STAT:OPER:NTR 0')
-ngu401.write('STAT:OPER:PTR 8192')
-ngu401.write('STAT:OPER:ENABLE 8192')                        # instrument operation summary
-ngu401.write('STAT:OPER:INST:NTR 0')
-ngu401.write('STAT:OPER:INST:PTR 2')
-ngu401.write('STAT:OPER:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:OPER:INST:ISUM1:NTR 0')
-ngu401.write('STAT:OPER:INST:ISUM1:PTR 4096') 
-ngu401.write('STAT:OPER:INST:ISUM1:ENABLE 4096')             # Fastlog data available
-
-ngu401.write('STAT:QUES:NTR 0')
-ngu401.write('STAT:QUES:PTR 8192')
-ngu401.write('STAT:QUES:ENABLE 8192')                        # Instrument questionable summary
-ngu401.write('STAT:QUES:INST:NTR 0')
-ngu401.write('STAT:QUES:INST:PTR 2')
-ngu401.write('STAT:QUES:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:QUES:INST:ISUM1:NTR 0')
-ngu401.write('STAT:QUES:INST:ISUM1:PTR 2048')
-ngu401.write('STAT:QUES:INST:ISUM1:ENABLE 2048')             # Fastlog data skipped
-
-# Clear events
-ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
-ngu401.query('STAT:OPER:INST:EVEN?')
-ngu401.query('STAT:OPER:EVEN?')
-
-ngu401.query('STAT:QUES:INST:ISUM1:EVEN?')
-ngu401.query('STAT:QUES:INST:EVEN?')
-ngu401.query('STAT:QUES:EVEN?')
-
-ngu401.write('FLOG:TARG SCPI')                               # FastLog
-ngu401.write('FLOG:SRAT S500K')                              # 500 ks/s
-
-arb = 'ARB:DATA '
-arb += '{:f},{:f},{:f},{:f},0,'.format(0, maxI, minI, stepDuration[1])
-
-for i, v in enumerate(numpy.linspace(minV, maxV, stepNumber)):
-    arb += '{:f},{:f},{:f},{:f},0,'.format(v, maxI, minI, stepDuration[0])
-    arb += '{:f},{:f},{:f},{:f},0'.format(0, maxI, minI, stepDuration[1])
-
-    if i + 1 < stepNumber:
-        arb += ','
-
-ngu401.write('ARB:REP 1')                                            # 1 Repetition
-ngu401.write('ARB:BEH:END OFF')                                      # Disable output at end of ARB
-ngu401.write(arb)                                                    # Linear sweep vMin->vMax->vMin
-ngu401.write('ARB:TRAN 1')                                           # Transfer the arbitrary table
+Profile.reset(ngu401)
+
+setup = Profile.Profile('Pulse', \
+[
+    'ARB:REP 1',                                    # 1 Repetition
+    'ARB:BEH:END OFF',                              # Disable output at end of ARB
+])
+
+setup.apply(ngu401)
+
+fastLog = FastLog.FastLog(ngu401)
+fastLog.setup()
+
+pulses = numpy.zeros((stepNumber, 2))
+pulses[:, 0] = numpy.linspace(minV, maxV, stepNumber)
+
+voltage  = numpy.concatenate(([0], pulses.ravel()))
+duration = numpy.concatenate(([stepDuration[1]], numpy.tile(stepDuration, stepNumber)))
+
+Arb.load(ngu401, Arb.table(voltage, maxI, minI, duration))           # Linear sweep vMin->vMax->vMin
 ngu401.write('ARB:STAT 1')
 
 # Setup buffers
 duration = stepDuration[1] + (stepDuration[0] + stepDuration[1]) * stepNumber
 
-vBuffer = numpy.zeros(int(510_000 * (duration + 1)), dtype = float)
-iBuffer = numpy.zeros(int(510_000 * (duration + 1)), dtype = float)
+vBuffer = numpy.zeros(int(FastLog.maxRate * (duration + 1)), dtype = FastLog.dtype)
+iBuffer = numpy.zeros(int(FastLog.maxRate * (duration + 1)), dtype = FastLog.dtype)
 tBuffer = []
 
 idx = 0
 
-ngu401.write('FLOG 1')
-ngu401.query('*OPC?')
+fastLog.start()
     
 ngu401.write('OUTP 1')
 
 temperature.read() # Discard all
 
-lastChunk = False
-startTime = 0
-
-while True:
-    stb = ngu401.read_stb()
-
-    if stb & 128:
-        currentTime = time.time()
-        
-        if  startTime == 0:
-            startTime = currentTime
-
-        data = ngu401.query_binary_values('FLOG:DATA?', datatype = 'f', data_points = 50)
-        
-        # Clear event bits
-        ngu401.query('STAT:OPER:EVEN?')
-        ngu401.query('STAT:OPER:INST:EVEN?')
-        ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
+for v, i in fastLog.blocks():
+    vBuffer[idx : idx + v.size] = v
+    iBuffer[idx : idx + i.size] = i
+    tBuffer.extend(temperature.read())
 
-        v = data[0::2]
-        i = data[1::2]
-        
-        vBuffer[idx : idx + len(v)] = v
-        iBuffer[idx : idx + len(i)] = i
-        tBuffer.extend(temperature.read())
-        
-        idx += len(v)
+    idx += v.size
 
-        if idx + len(data) > len(vBuffer) or lastChunk:
-            break
+    if idx + 2 * v.size > vBuffer.size:
+        break
 
-        if int(ngu401.query('OUTP?')) == 0:     # If output is off, get one last chunk of data before leaving loop
-            lastChunk = True
+    Telemetry.publish('Remaining: {:.1f} s'.format(duration - (fastLog.currentTime - fastLog.startTime)), 'remaining')
 
-        print('Remaining: {:.1f} s'.format(duration - (currentTime - startTime)))
-
-    if stb & 8:
-        print('Lost data!')
-        break;
-
-rate = (idx - len(v)) / (currentTime - startTime)
+rate = fastLog.rate
 
 vBuffer = vBuffer[:idx]
 iBuffer = iBuffer[:idx]
-tmBuffer = numpy.arange(vBuffer.size) / rate
+tmBuffer = Clock.axis(vBuffer.size, rate, fastLog.gaps)
 
 f = interpolate.interp1d(numpy.linspace(0, tmBuffer[-1], len(tBuffer)), tBuffer, kind = 'linear')
-tBuffer = f(tmBuffer)
+tBuffer = f(tmBuffer).astype(FastLog.dtype)
+
+Capture.save(filename, compress, vBuffer = vBuffer, iBuffer = iBuffer, tBuffer = tBuffer, tmBuffer = tmBuffer, rate = rate, gaps = Clock.crop(fastLog.gaps, 0, vBuffer.size))
 
-numpy.savez(filename, vBuffer = vBuffer, iBuffer = iBuffer, tBuffer = tBuffer, tmBuffer = tmBuffer)
+if trace:
+    Trace.report()
@@ -1,6 +1,16 @@
-import pyvisa
 import numpy
 import time
+import sys
+
+sys.path.append('../Common')
+
+import Arb
+import Clock
+import FastLog
+import Instrument
+import Profile
+import Telemetry
+import Trace
 
 import Temperature
 
@@ -21,127 +31,115 @@ period     = 0.01
 
 filename = '../Data/Peltier/pwm.npz'
 
+trace = False               # Print the time spent in each instrument command at the end of the run
+
 
 # Code
 
 temperature = Temperature.Temperature(temperaturePort)
 
-ngu401 = pyvisa.ResourceManager().open_resource(resource, timeout = 30_000)
+ngu401 = Instrument.open(resource, trace = trace, name = 'NGU401')
 ngu401.clear()
 
-ngu401.write('*RST')
-ngu401.query('*OPC?')
-
-ngu401.write('STAT:OPER:NTR 0')
-ngu401.write('STAT:OPER:PTR 8192')
-ngu401.write('STAT:OPER:ENABLE 8192')                        # instrument operation summary
-ngu401.write('STAT:OPER:INST:NTR 0')
-ngu401.write('STAT:OPER:INST:PTR 2')
-ngu401.write('STAT:OPER:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:OPER:INST:ISUM1:NTR 0')
-ngu401.write('STAT:OPER:INST:ISUM1:PTR 4096') 
-ngu401.write('STAT:OPER:INST:ISUM1:ENABLE 4096')             # Fastlog data available
-
-ngu401.write('STAT:QUES:NTR 0')
-ngu401.write('STAT:QUES:PTR 8192')
-ngu401.write('STAT:QUES:ENABLE 8192')                        # Instrument questionable summary
-ngu401.write('STAT:QUES:INST:NTR 0')
-ngu401.write('STAT:QUES:INST:PTR 2')
-ngu401.write('STAT:QUES:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:QUES:INST:ISUM1:NTR 0')
-ngu401.write('STAT:QUES:INST:ISUM1:PTR 2048')
-ngu401.write('STAT:QUES:INST:ISUM1:ENABLE 2048')             # Fastlog data skipped
-
-ngu401.write('FLOG:TARG SCPI')                               # FastLog
-ngu401.write('FLOG:SRAT S500K')                              # 500 ks/s
-
-dcBuffer = []
-pBuffer  = []
-tBuffer  = []
-tmBuffer = []
+Profile.reset(ngu401)
 
-dutyCycle  = numpy.linspace(-1.0, 1.0, stepNumber)       # Negative duty cycle indicates that the PWM voltage is negative
+dutyCycle = numpy.linspace(-1.0, 1.0, stepNumber)       # Negative duty cycle indicates that the PWM voltage is negative
 
-startTime = 0
+durations    = numpy.full(stepNumber, stepDuration[1], dtype = float)
+durations[0] = stepDuration[0]
 
-for index in range(dutyCycle.size):
-    # Clear events
-    ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
-    ngu401.query('STAT:OPER:INST:EVEN?')
-    ngu401.query('STAT:OPER:EVEN?')
+periods  = numpy.round(durations / period).astype(int)     # PWM periods of each step
 
-    ngu401.query('STAT:QUES:INST:ISUM1:EVEN?')
-    ngu401.query('STAT:QUES:INST:EVEN?')
-    ngu401.query('STAT:QUES:EVEN?')
+# One PWM period per step, without the empty on or off time
 
-    if dutyCycle[index] > 0:
-        vOutput = v
-    else:
-        vOutput = -v
+tables = []
 
+for index in range(stepNumber):
     onTime  = period * abs(dutyCycle[index])
     offTime = period * (1. - abs(dutyCycle[index]))
 
-    arb = 'ARB:DATA '
-    
-    if onTime != 0:
-        arb += '{:f},{:f},{:f},{:f},0'.format(vOutput, maxI, minI, onTime)
-    
-    if onTime != 0 and offTime != 0:
-        arb += ','
-    
-    if offTime != 0:
-        arb += '{:f},{:f},{:f},{:f},0'.format(0, maxI, minI, offTime)
-
-    ngu401.write('ARB:REP 0')                                    # Repeat indefinitely
-    ngu401.write('ARB:BEH:END OFF')                              # Disable output at end of ARB
-    ngu401.write(arb)                                            # Linear sweep vMin->vMax->vMin
-    ngu401.write('ARB:TRAN 1')                                   # Transfer the arbitrary table
-    ngu401.write('ARB:STAT 1')
-
-    ngu401.write('FLOG 1')
-    ngu401.query('*OPC?')
-    
-    ngu401.write('OUTP 1')
-
-    stepTime = time.time()
-
-    while True:
-        stb = ngu401.read_stb()
-
-        if stb & 128:
-            data = ngu401.query_binary_values('FLOG:DATA?', datatype = 'f', data_points = 50)
-        
-            # Clear event bits
-            ngu401.query('STAT:OPER:EVEN?')
-            ngu401.query('STAT:OPER:INST:EVEN?')
-            ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
-
-            currentTime = time.time()
-
-            if startTime == 0:
-                startTime = currentTime
-
-            p = (numpy.array(data[0::2]) * numpy.array(data[1::2])).mean()
-            t = numpy.array(temperature.read()).mean()
-
-            pBuffer.append(p)
-            tBuffer.append(t)
-            dcBuffer.append(dutyCycle[index])
-            tmBuffer.append(currentTime - startTime)
-            
-            print('[{:.1f} s] Duty Cycle: {:.3f}, Power: {:.3f} W, Temperature {:.3f} ºC'.format(currentTime - startTime, dutyCycle[index], p, t))
-
-            if (index == 0 and currentTime - stepTime > stepDuration[0]) or (index != 0 and currentTime - stepTime > stepDuration[1]):
-                break;
-
-        if stb & 8:
-            print('Lost data!')
-            break;
-
-    ngu401.write('FLOG 0')
-    ngu401.query('*OPC?')
-
-    ngu401.write('OUTP 0')
-
-numpy.savez(filename, dcBuffer = dcBuffer, pBuffer = pBuffer, tBuffer = tBuffer, tmBuffer = tmBuffer)
+    arb = Arb.table([v if dutyCycle[index] > 0 else -v, 0], maxI, minI, [onTime, offTime])
+
+    tables.append(arb[arb[:, 3] != 0])
+
+# The steps are chained: each step period repeats until the next one is transferred, while the output and FastLog
+# keep running. The whole schedule does not fit in a single table, the first step alone is thousands of periods.
+
+setup = Profile.Profile('PWM', \
+[
+    'ARB:REP 0',                                    # Repeat the step period indefinitely
+    'ARB:BEH:END OFF',                              # Disable output at end of ARB
+])
+
+setup.apply(ngu401)
+
+fastLog = FastLog.FastLog(ngu401)
+fastLog.setup()
+
+Arb.load(ngu401, tables[0])
+ngu401.write('ARB:STAT 1')
+
+pBuffer  = []
+tBuffer  = []
+
+stepTime = []               # Host time at which each step started
+blockEnd = []               # Sample at which each block ends
+
+step     = 0
+finished = False
+samples  = 0
+
+
+def switch(samples, rate):
+    # Called by the FastLog reader after each chunk, so the step lengths do not depend on the temperature reads. Each
+    # step is timed from the host time at which it started.
+    global step, finished
+
+    if time.perf_counter() - stepTime[-1] < periods[step] * period:
+        return
+
+    if step + 1 >= stepNumber:
+        finished = True
+        return
+
+    step += 1
+
+    with fastLog.lock:
+        Arb.load(ngu401, tables[step])
+        ngu401.write('ARB:STAT 1')
+
+        stepTime.append(time.perf_counter())
+
+
+fastLog.start()
+
+ngu401.write('OUTP 1')
+stepTime.append(time.perf_counter())
+
+for vBlock, iBlock in fastLog.blocks(callback = switch):
+    samples += vBlock.size
+
+    p = (vBlock * iBlock).mean()
+    t = numpy.array(temperature.read()).mean()
+
+    pBuffer.append(p)
+    tBuffer.append(t)
+    blockEnd.append(samples)
+
+    Telemetry.publish('[{:.1f} s] Duty Cycle: {:.3f}, Power: {:.3f} W, Temperature {:.3f} ºC'.format(samples / fastLog.rate, dutyCycle[step], p, t), 'reading')
+
+    if finished:
+        break
+
+fastLog.stop()
+
+ngu401.write('OUTP 0')
+
+stepStart = numpy.maximum(fastLog.sample(stepTime), 0)                                   # Sample at which each step started
+dcBuffer  = dutyCycle[numpy.maximum(numpy.searchsorted(stepStart, blockEnd, side = 'right') - 1, 0)]
+tmBuffer  = Clock.axis(samples, fastLog.rate, fastLog.gaps)[numpy.array(blockEnd) - 1]    # Block times on the fitted clock
+
+numpy.savez(filename, dcBuffer = dcBuffer, pBuffer = pBuffer, tBuffer = tBuffer, tmBuffer = tmBuffer, stepStart = stepStart, rate = fastLog.rate, gaps = Clock.crop(fastLog.gaps, 0, samples))
+
+if trace:
+    Trace.report()
@@ -1,8 +1,15 @@
-import time
 import numpy
-import pyvisa
-import scipy.interpolate as interpolate
 import matplotlib.pyplot as pyplot
+import sys
+
+sys.path.append('../Common')
+
+import Capture
+import Clock
+import FastLog
+import Instrument
+import Profile
+import Trace
 
 
 # Settings
@@ -13,114 +20,36 @@ filename = '../Data/Regulation/modulation_100Hz.npy'
 duration = 3
 cycles   = 2
 
+trace = False               # Print the time spent in each instrument command at the end of the run
+
 
 # Code
 
-ngu401 = pyvisa.ResourceManager().open_resource(resource, timeout = 30_000)
+ngu401 = Instrument.open(resource, trace = trace, name = 'NGU401')
 ngu401.clear()
 
-ngu401.write('*RST')
-ngu401.query('*OPC?')
+Profile.reset(ngu401)
 
 ngu401.write('SOUR:PRI VOLT')
 
 ngu401.write('SOUR:CURR:NEG MIN')
 ngu401.write('SOUR:CURR MAX')
 
-ngu401.write('STAT:OPER:NTR 0')
-ngu401.write('STAT:OPER:PTR 8192')
-ngu401.write('STAT:OPER:ENABLE 8192')                        # instrument operation summary
-ngu401.write('STAT:OPER:INST:NTR 0')
-ngu401.write('STAT:OPER:INST:PTR 2')
-ngu401.write('STAT:OPER:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:OPER:INST:ISUM1:NTR 0')
-ngu401.write('STAT:OPER:INST:ISUM1:PTR 4096') 
-ngu401.write('STAT:OPER:INST:ISUM1:ENABLE 4096')             # Fastlog data available
-
-ngu401.write('STAT:QUES:NTR 0')
-ngu401.write('STAT:QUES:PTR 8192')
-ngu401.write('STAT:QUES:ENABLE 8192')                        # Instrument questionable summary
-ngu401.write('STAT:QUES:INST:NTR 0')
-ngu401.write('STAT:QUES:INST:PTR 2')
-ngu401.write('STAT:QUES:INST:ENABLE 2')                      # Channel 1
-ngu401.write('STAT:QUES:INST:ISUM1:NTR 0')
-ngu401.write('STAT:QUES:INST:ISUM1:PTR 2048')
-ngu401.write('STAT:QUES:INST:ISUM1:ENABLE 2048')             # Fastlog data skipped
-
-# Clear events
-ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
-ngu401.query('STAT:OPER:INST:EVEN?')
-ngu401.query('STAT:OPER:EVEN?')
-
-ngu401.query('STAT:QUES:INST:ISUM1:EVEN?')
-ngu401.query('STAT:QUES:INST:EVEN?')
-ngu401.query('STAT:QUES:EVEN?')
-
-ngu401.write('FLOG:TARG SCPI')                               # FastLog
-ngu401.write('FLOG:SRAT S500K')                              # 500 ks/s
+fastLog = FastLog.FastLog(ngu401)
+fastLog.setup()
 
 # Enable modulation
 ngu401.write('MOD 1')
 ngu401.write('MOD:GAIN 1')
 
 
-# Setup buffers
+# Capture
 
-vBuffer = numpy.zeros(int(510_000 * (duration + 3)), dtype = float)
-iBuffer = numpy.zeros(int(510_000 * (duration + 3)), dtype = float)
+fastLog.start()
 
-idx = 0
-
-ngu401.write('FLOG 1')
-ngu401.query('*OPC?')
-    
 ngu401.write('OUTP 1')
 
-lastChunk = 3
-startTime = 0
-
-while True:
-    stb = ngu401.read_stb()
-
-    currentTime = time.time()
-
-    if startTime != 0 and currentTime - startTime > duration + .5:
-        break
-
-    if stb & 128:
-        if  startTime == 0:
-            startTime = currentTime
-
-        data = ngu401.query_binary_values('FLOG:DATA?', datatype = 'f', data_points = 50)
-        
-        # Clear event bits
-        ngu401.query('STAT:OPER:EVEN?')
-        ngu401.query('STAT:OPER:INST:EVEN?')
-        ngu401.query('STAT:OPER:INST:ISUM1:EVEN?')
-
-        v = data[0::2]
-        i = data[1::2]
-        
-        vBuffer[idx : idx + len(v)] = v
-        iBuffer[idx : idx + len(i)] = i
-        
-        idx += len(v)
-
-        if idx + len(data) > len(vBuffer) or lastChunk == 0:
-            break
-
-        if int(ngu401.query('OUTP?')) == 0:     # If output is off, get one last chunk of data before leaving loop
-            lastChunk -= 1
-
-        print('Remaining: {:.1f} s'.format(duration - (currentTime - startTime)))
-
-    if stb & 8:
-        print('Lost data!')
-        break;
-
-
-vBuffer = vBuffer[:idx]
-iBuffer = iBuffer[:idx]
+vBuffer, iBuffer = fastLog.capture(duration, timeout = duration + .5)
 
 idx = numpy.where(numpy.logical_and(vBuffer[: -1] < 0, vBuffer[1 :] > 0))[0]
 
@@ -136,6 +65,10 @@ vBuffer = vBuffer[start - 1 : end + 1]
 iBuffer = iBuffer[start - 1 : end + 1]
 
 numpy.save(filename, vBuffer)
+Capture.annotate(filename, rate = fastLog.rate, gaps = Clock.crop(fastLog.gaps, start - 1, end + 1).tolist())
+
+if trace:
+    Trace.report()
 
 pyplot.plot(vBuffer)
 #pyplot.plot(iBuffer)
@@ -1,9 +1,15 @@
 import numpy
 import matplotlib.pyplot as pyplot
+import sys
 
+sys.path.append('../Common')
 
-def plot(v, title):
-    t = numpy.arange(v.size) / (500_000 * 1.01348)
+import Capture
+import Clock
+
+
+def plot(v, filename, title):
+    t = Clock.axis(v.size, Capture.rate(filename), Capture.gaps(filename))
 
     pyplot.plot(t * 1000, v)
 
@@ -17,17 +23,17 @@ f1hz   = numpy.load('../Data/Regulation/modulation_1Hz.npy')
 f10hz  = numpy.load('../Data/Regulation/modulation_10Hz.npy')
 f100hz = numpy.load('../Data/Regulation/modulation_100Hz.npy')
 
-plot(f1hz, '1 Hz Sine Wave')
+plot(f1hz, '../Data/Regulation/modulation_1Hz.npy', '1 Hz Sine Wave')
 pyplot.gcf().set_size_inches(12, 6)
 pyplot.savefig('../Data/Regulation/modulation_1Hz.png', dpi = 300)
 pyplot.clf()
 
-plot(f10hz, '10 Hz Sine Wave')
+plot(f10hz, '../Data/Regulation/modulation_10Hz.npy', '10 Hz Sine Wave')
 pyplot.gcf().set_size_inches(12, 6)
 pyplot.savefig('../Data/Regulation/modulation_10Hz.png', dpi = 300)
 pyplot.clf()
 
-plot(f100hz, '100 Hz Sine Wave')
+plot(f100hz, '../Data/Regulation/modulation_100Hz.npy', '100 Hz Sine Wave')
 pyplot.gcf().set_size_inches(12, 6)
 pyplot.savefig('../Data/Regulation/modulation_100Hz.png', dpi = 300)
 pyplot.clf()
@@ -1,5 +1,11 @@
 import numpy
 import matplotlib.pyplot as pyplot
+import sys
+
+sys.path.append('../Common')
+
+import Capture
+import Clock
 
 
 # Settings
@@ -10,12 +16,12 @@ size = (12, 6)
 # Functions
 
 def load(filename):
-    file = numpy.load(filename)
-
-    vBuffer = file['vBuffer']
-    iBuffer = file['iBuffer']
+    # Traces on the uniformly sampled time axis, the samples lost during the capture are NaN and break the lines
+    vBuffer, iBuffer = Capture.load(filename)
 
-    tBuffer = numpy.arange(vBuffer.size) / (500_000 * 1.01348)
+    vBuffer = Clock.expand(vBuffer, Capture.gaps(filename))
+    iBuffer = Clock.expand(iBuffer, Capture.gaps(filename))
+    tBuffer = numpy.arange(vBuffer.size) / Capture.rate(filename)
 
     return tBuffer, vBuffer, iBuffer
 
@@ -78,16 +84,16 @@ def plotStackTV(tBuffer, vBuffer, iBuffer, title, search = 'i', threshold = 0.15
 
         if plot == 'v':
             if search == 'v':
-                delta = vBuffer[startIndex + span // 3: endIndex - span // 3].mean()
+                delta = numpy.nanmean(vBuffer[startIndex + span // 3: endIndex - span // 3])
             
             elif search == 'i':
-                delta = vBuffer[startIndex - 200 : startIndex - 100].mean()
+                delta = numpy.nanmean(vBuffer[startIndex - 200 : startIndex - 100])
             
             pyplot.plot(tBuffer[: endIndex - startIndex] * 1000. + start, vBuffer[startIndex : endIndex] - delta)
             pyplot.ylabel('Voltage (V)')
         
         elif plot == 'i':
-            delta = iBuffer[startIndex + span // 3: endIndex - span // 3].mean()
+            delta = numpy.nanmean(iBuffer[startIndex + span // 3: endIndex - span // 3])
             
             pyplot.plot(tBuffer[: endIndex - startIndex] * 1000. + start, iBuffer[startIndex : endIndex] - delta)
             pyplot.ylabel('Current (A)')
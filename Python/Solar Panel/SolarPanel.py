@@ -1,6 +1,12 @@
-import pyvisa
 import time
 import numpy
+import sys
+
+sys.path.append('../Common')
+
+import Instrument
+import Range
+import Trace
 
 
 # Settings
@@ -8,10 +14,14 @@ import numpy
 resource = 'tcpip0::192.168.0.32::hislip0::instr'
 step = 0.01
 
+rangeLock = True                            # Pin the readback ranges to the setpoint and the previous reading
+
+trace = False                               # Print the time spent in each instrument command at the end of the run
+
 
 # Code
 
-ngu = pyvisa.ResourceManager().open_resource(resource, timeout = 30_000)
+ngu = Instrument.open(resource, trace = trace, name = 'NGU401')
 ngu.clear()
 
 ngu.write('*RST')                           # Reset instrument
@@ -24,6 +34,15 @@ ngu.write('SENS:NPLC 1')                    # Set the number of power line cycle
 ngu.write('OUTP 1')                         # Turn on the output
 ngu.query('*OPC?')                          # Wait for previous operations to complete
 
+rangers = [Range.ngu401(ngu, 'VOLT'), Range.ngu401(ngu, 'CURR')] if rangeLock else None
+
+
+def read():
+    query = ngu.query('READ?')                    # Read the voltage and current
+
+    return [float(x) for x in query.split(',')]
+
+
 source = 0
 data = []
 
@@ -34,9 +53,7 @@ while source <= 20:
 
     currentTime = time.time()
 
-    query = ngu.query('READ?')                    # Read the voltage and current
-
-    v, i = [float(x) for x in query.split(',')]
+    v, i = read() if rangers is None else Range.read(read, rangers, (source, None))
     
     data.append([v, i])
     
@@ -55,3 +72,6 @@ print('Isc  = {:.3f} mA'.format(-vi[0, 1] * 1000.))
 print('Vmax = {:.3f} V'.format(vi[idx, 0]))
 print('Imax = {:.3f} mA'.format(-vi[idx, 1] * 1000.))
 print('Pmax = {:.3f} mW'.format(-vi[idx, 0] * vi[idx, 1] * 1000.))
+
+if trace:
+    Trace.report()